@@ -0,0 +1,122 @@
+import numpy as np
+from Agents.agents import Agents
+
+
+class BatchAgents(Agents):
+    """
+    Simulates num_swarms independent swarms of num_agents agents at once. The agents of every swarm are stored as
+    consecutive columns of one (3, num_swarms*num_agents) array, so compute_low_level_control and dynamics advance
+    all the swarms with the same array operations (and the same physics) as a single swarm. The collision grid gives
+    every swarm its own cells, so agents of different swarms never collide.
+    The poses and landmarks are read and written as (num_swarms, 3, num_agents) arrays (see poses and
+    swarm_landmarks). Inherited attributes such as num_agents and agents_positions refer to all the agents of the
+    batch; the agents of one swarm are num_agents_per_swarm.
+    Only the "grid" broad phase is supported.
+    """
+    # The dense broad phase would make agents of different swarms collide
+    dense_max_agents = 0
+
+    def __init__(self, num_swarms, num_agents):
+        self.num_swarms = num_swarms
+        self.num_agents_per_swarm = num_agents
+        # Number of agent-agent contacts resolved in every swarm since the last reset_collision_counts
+        self.collision_counts = np.zeros(num_swarms, dtype=int)
+        super(BatchAgents, self).__init__(num_swarms * num_agents)
+
+    @property
+    def poses(self):
+        # View with shape (num_swarms, 3, num_agents) of agents_positions
+        return self.agents_positions.reshape(3, self.num_swarms, self.num_agents_per_swarm).transpose(1, 0, 2)
+
+    @property
+    def swarm_landmarks(self):
+        # View with shape (num_swarms, 3, num_agents) of landmarks
+        return self.landmarks.reshape(3, self.num_swarms, self.num_agents_per_swarm).transpose(1, 0, 2)
+
+    def to_columns(self, values):
+        # (num_swarms, 3, num_agents) -> (3, num_swarms*num_agents). Arrays with shape (3, n) are returned unchanged
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 3:
+            assert values.shape == (self.num_swarms, 3, self.num_agents_per_swarm), \
+                "ERROR: Input poses must have shape (num_swarms, 3, num_agents)."
+            values = values.transpose(1, 0, 2).reshape(3, self.num_agents)
+        return values
+
+    def set_poses(self, positions):
+        super(BatchAgents, self).set_poses(self.to_columns(positions))
+
+    def set_landmarks(self, landmarks):
+        super(BatchAgents, self).set_landmarks(self.to_columns(landmarks))
+
+    def check_collisions(self):
+        raise NotImplementedError("The dense broad phase would make agents of different swarms collide, "
+                                  "BatchAgents only supports find_collision_pairs (the \"grid\" broad phase).")
+
+    def get_cell_keys(self, x, y, radius):
+        # The cells of every swarm are a separate block of keys, and the empty border of the grid keeps the
+        # neighbours of a cell inside its block
+        cells, n_rows = super(BatchAgents, self).get_cell_keys(x, y, radius)
+        n_cells = (int(self.max_x // radius) + 3) * n_rows
+        return cells + self.swarm_indexes * n_cells, n_rows
+
+    def resolve_collisions(self):
+        return bool(np.any(self.resolve_swarm_collisions(np.ones(self.num_swarms, dtype=bool))))
+
+    def resolve_swarm_collisions(self, swarms):
+        i, _, overlaps, _, inter_robot_angles = self.find_collision_pairs()
+        if not np.all(swarms):
+            in_swarms = swarms[self.swarm_indexes[i]]
+            i, overlaps, inter_robot_angles = i[in_swarms], overlaps[in_swarms], inter_robot_angles[in_swarms]
+        # Every contact is listed twice, as (i, j) and (j, i)
+        contacts = np.bincount(self.swarm_indexes[i], minlength=self.num_swarms) // 2
+        self.collision_counts += contacts
+        if i.shape[0] > 0:
+            self.separate_pairs(i, overlaps, inter_robot_angles)
+        return contacts > 0
+
+    def reset_collision_counts(self):
+        self.collision_counts[:] = 0
+
+    def reset(self, initial_positions=None, initial_landmarks=None):
+        """
+        Resets every swarm.
+        :param initial_positions: Poses with shape (num_swarms, 3, num_agents). Random by default
+        :param initial_landmarks: Landmarks with shape (num_swarms, 3, num_agents). Random by default
+        :return: tuple (poses, landmarks) with shape (num_swarms, 3, num_agents)
+        """
+        super(BatchAgents, self).reset(initial_positions, initial_landmarks)
+        self.reset_collision_counts()
+        return self.poses, self.swarm_landmarks
+
+    def reset_swarms(self, swarms, initial_positions=None, initial_landmarks=None):
+        """
+        Resets some of the swarms. Collisions are only resolved inside those swarms, so the others are not changed,
+        and their in_contact and collision_counts start again as in reset.
+        :param swarms: Indexes of the swarms to reset
+        :param initial_positions: Poses with shape (len(swarms), 3, num_agents). Random by default
+        :param initial_landmarks: Landmarks with shape (len(swarms), 3, num_agents). Random by default
+        :return:
+        """
+        swarms = np.arange(self.num_swarms)[swarms]
+        n = swarms.shape[0] * self.num_agents_per_swarm
+        if initial_positions is None:
+            initial_positions = self.sample_poses(n).reshape(3, -1, self.num_agents_per_swarm).transpose(1, 0, 2)
+        if initial_landmarks is None:
+            initial_landmarks = self.sample_poses(n).reshape(3, -1, self.num_agents_per_swarm).transpose(1, 0, 2)
+        poses, landmarks = self.poses, self.swarm_landmarks
+        poses[swarms] = initial_positions
+        landmarks[swarms] = initial_landmarks
+
+        reset = np.zeros(self.num_swarms, dtype=bool)
+        reset[swarms] = True
+        self.in_contact[swarms] = self.resolve_swarm_collisions(reset)[swarms]
+        self.collision_counts[swarms] = 0
+
+    def step(self, references):
+        """
+        Moves every swarm one step towards its references.
+        :param references: Landmarks with shape (num_swarms, 3, num_agents)
+        :return: tuple (poses, landmarks) with shape (num_swarms, 3, num_agents)
+        """
+        super(BatchAgents, self).step(references)
+        return self.poses, self.swarm_landmarks
@@ -0,0 +1,83 @@
+import numpy as np
+from Agents.batch_agents import BatchAgents
+
+
+class SwarmEnv:
+    """
+    Vectorized environment over num_swarms swarms, for learning formation policies.
+    Every episode has goal poses for the agents (the landmarks given to reset). In every step the policy chooses the
+    landmarks (references) of the agents and all the swarms move with the physics of Agents. The episode of a swarm
+    ends when all of its agents are within distance_margin of their goals or after max_episode_steps steps, and that
+    swarm is reset alone: with the poses and goals given to the last reset call, or random ones.
+    """
+    def __init__(self, num_swarms, num_agents, max_episode_steps=350, collision_penalty=1.0):
+        """
+
+        :param num_swarms: Number of swarms
+        :param num_agents: Number of agents of every swarm
+        :param max_episode_steps: Maximum number of steps of an episode
+        :param collision_penalty: Reward lost per agent-agent contact
+        """
+        self.num_swarms = num_swarms
+        self.num_agents = num_agents
+        self.max_episode_steps = max_episode_steps
+        self.collision_penalty = collision_penalty
+        self.agents = BatchAgents(num_swarms, num_agents)
+        self.goals = None
+        self.episode_steps = np.zeros(num_swarms, dtype=int)
+        self.initial_positions, self.initial_goals = None, None
+
+    def observe(self):
+        # Observations with shape (num_swarms, 6, num_agents): agents poses stacked over their goals
+        return np.concatenate((self.agents.poses, self.goals), axis=1)
+
+    def reset(self, initial_positions=None, initial_landmarks=None):
+        """
+        Resets every swarm. The given poses and goals are also used when a swarm is reset automatically.
+        :param initial_positions: Poses with shape (num_swarms, 3, num_agents). Random by default
+        :param initial_landmarks: Goal poses with shape (num_swarms, 3, num_agents). Random by default
+        :return: observations with shape (num_swarms, 6, num_agents)
+        """
+        self.initial_positions = None if initial_positions is None else np.array(initial_positions, dtype=float)
+        self.initial_goals = None if initial_landmarks is None else np.array(initial_landmarks, dtype=float)
+        self.agents.reset(self.initial_positions, self.initial_goals)
+        self.goals = self.agents.swarm_landmarks.copy()
+        self.episode_steps[:] = 0
+        return self.observe()
+
+    def step(self, landmarks=None):
+        """
+        Moves every swarm one step and resets the swarms whose episode ended.
+        :param landmarks: References of the agents with shape (num_swarms, 3, num_agents). By default the goals
+        :return: tuple (observations, rewards, dones, infos)
+            observations: array with shape (num_swarms, 6, num_agents), after the automatic resets
+            rewards: array with shape (num_swarms,): minus the mean distance of the agents to their goals [cm] and
+                     collision_penalty per contact during the step
+            dones: boolean array with shape (num_swarms,)
+            infos: dictionary with the arrays "collisions" (contacts per swarm), "converged" (the swarm reached its
+                   goals), "episode_steps" (length of the episodes that ended) and "final_observations" (observations
+                   of the swarms that ended, before their reset)
+        """
+        self.agents.reset_collision_counts()
+        self.agents.step(self.goals if landmarks is None else landmarks)
+        self.episode_steps += 1
+
+        poses = self.agents.poses
+        distances = np.hypot(poses[:, 0, :] - self.goals[:, 0, :], poses[:, 1, :] - self.goals[:, 1, :])
+        collisions = self.agents.collision_counts.copy()
+        rewards = -np.mean(distances, axis=1) - self.collision_penalty * collisions
+        converged = np.max(distances, axis=1) < self.agents.distance_margin
+        dones = converged | (self.episode_steps >= self.max_episode_steps)
+
+        observations = self.observe()
+        infos = {"collisions": collisions, "converged": converged, "episode_steps": self.episode_steps[dones],
+                 "final_observations": observations[dones]}
+        swarms = np.nonzero(dones)[0]
+        if swarms.shape[0] > 0:
+            self.agents.reset_swarms(swarms,
+                                     None if self.initial_positions is None else self.initial_positions[swarms],
+                                     None if self.initial_goals is None else self.initial_goals[swarms])
+            self.goals[swarms] = self.agents.swarm_landmarks[swarms]
+            self.episode_steps[swarms] = 0
+            observations[swarms] = self.observe()[swarms]
+        return observations, rewards, dones, infos
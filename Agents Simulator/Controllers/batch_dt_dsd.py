@@ -0,0 +1,43 @@
+import numpy as np
+from Controllers.dt_dsd import DTDSD
+
+
+# Discrete-time Distributed Smith Dynamics for many independent scenarios at once
+class BatchDTDSD(DTDSD):
+    """
+    Runs num_scenarios independent DTDSD controllers that share their parameters (robots, populations,
+    epsilon and gamma). The state has shape (num_scenarios, num_robots*num_pops) and every step advances
+    all the scenarios with the edge-list kernel of the sparse DTDSD. The graph can be shared by every
+    scenario or given per scenario.
+    """
+    def __init__(self, num_scenarios, num_robots=2, num_populations=1, epsilon=[0.1], gamma=[140], edges=None):
+        self._nb = num_scenarios
+        super(BatchDTDSD, self).__init__(num_robots, num_populations, epsilon, gamma, sparse=True, edges=edges)
+
+    def reset(self, x0=None, scales=None, silent=False):
+        # x0 has shape (num_robots*num_pops,) (same initial condition for every scenario) or
+        # (num_scenarios, num_robots*num_pops). scales has shape (num_pops,) or (num_scenarios, num_pops).
+        if x0 is None:
+            self._x = np.random.random((self._nb, self._n))
+            if scales is not None:
+                scales = np.broadcast_to(np.reshape(scales, (-1, self._np)), (self._nb, self._np))
+                self._x *= np.repeat(scales, self._nr, axis=1)
+        else:
+            x0 = np.asarray(x0, dtype=float)
+            assert x0.shape[-1] == self._n, "ERROR: the x0 array must be of shape (num_scenarios, num_robots*num_pops)."
+            self._x = np.array(np.broadcast_to(x0, (self._nb, self._n)))
+
+        if not silent:
+            return self.observe()
+
+    def step(self, external_signals): # external_signals must have shape (num_scenarios, num_pops, num_robots).
+        return super(BatchDTDSD, self).step(np.reshape(external_signals, (self._nb, self._n)))
+
+    def set_adjacency_matrix(self, adjacency_matrix=None):
+        # adjacency_matrix has shape (num_robots, num_robots) (shared graph) or
+        # (num_scenarios, num_robots, num_robots) (one graph per scenario)
+        if adjacency_matrix is None or np.ndim(adjacency_matrix) < 3:
+            return super(BatchDTDSD, self).set_adjacency_matrix(adjacency_matrix)
+        adj_matrix = np.clip(np.reshape(adjacency_matrix, (self._nb, self._nr, self._nr)) - np.eye(self._nr), 0, 1)
+        rows, cols = np.nonzero(np.any(adj_matrix > 0, axis=0))          # Union of the edges of every scenario
+        self.set_edge_list(np.stack((rows, cols), axis=1), adj_matrix[:, rows, cols])
@@ -7,33 +7,49 @@ import numpy as np
 # Discrete-time Distributed Smith Dynamics (with saturation)
 class DTDSD:
 
-    def __init__(self, num_robots=2, num_populations=1, epsilon=[0.1], gamma=[140]):
+    def __init__(self, num_robots=2, num_populations=1, epsilon=[0.1], gamma=[140], sparse=False, edges=None):
         self._nr = np.maximum(num_robots, 2)
         self._np = np.maximum(num_populations, 1)
         self._n = self._nr*self._np
+        # Sparse mode stores the graph as an edge list and never builds n x n matrices (see set_edge_list).
+        # The initial edges can be given to avoid building the default complete graph
+        self._sparse = sparse
+        assert edges is None or sparse, "ERROR: the edges can only be given in sparse mode."
 
         # ERROR CHECKING
         epsilon, gamma = self.error_checker(epsilon, gamma)
 
-        # Step-size matrix and gamma matrix
-        diagonal = []
-        gamma_matrix = np.zeros((self._n, self._n))
-        for i in range(self._np):
-            diagonal += [epsilon[i]] # Set this entry to 0 in order to use mass-varying dynamics (not used in IFAC paper)
-            diagonal += [epsilon[i]]*(self._nr - 1)
-            gamma_matrix[i*self._nr:(i+1)*self._nr, i*self._nr:(i+1)*self._nr] = gamma[i]
+        # Step-size and gamma per entry of x. Epsilon is diagonal and gamma is block-diagonal (one block per population)
+        self.set_step_size(epsilon)
+        self._gamma_vector = np.array(gamma, dtype=float).reshape(self._np, 1)
+        # Diagonal of the h matrix (the first robot of each population is not penalized)
+        self._h_diagonal = -np.ones(self._n)
+        self._h_diagonal[np.arange(self._np)*self._nr] = 0.0
 
-        self._epsilon_matrix = np.diag(diagonal).astype(float)
-        self._gamma_matrix = gamma_matrix.astype(float)
+        if not self._sparse:
+            # Gamma matrix
+            self._gamma_matrix = np.kron(np.diag(self._gamma_vector[:, 0]), np.ones((self._nr, self._nr)))
 
-        # Useful pre-computations
-        self._normalizer_matrix = np.kron(np.eye(self._np), np.ones(self._nr))
-        self._h_matrix = -np.eye(self._n)
-        self._h_matrix[np.arange(self._np)*self._nr, np.arange(self._np)*self._nr] = 0.0
+            # Useful pre-computations
+            self._normalizer_matrix = np.kron(np.eye(self._np), np.ones(self._nr))
+            self._h_matrix = np.diag(self._h_diagonal)
 
-        self.set_adjacency_matrix()
+        if edges is None:
+            self.set_adjacency_matrix()
+        else:
+            self.set_edge_list(edges)
         self.reset(silent=True)
 
+    def set_step_size(self, epsilon):
+        # epsilon is a list with the step-size of every population
+        diagonal = []
+        for i in range(self._np):
+            diagonal += [epsilon[i]] # Set this entry to 0 in order to use mass-varying dynamics (not used in IFAC paper)
+            diagonal += [epsilon[i]]*(self._nr - 1)
+        self._epsilon_vector = np.array(diagonal, dtype=float)
+        if not self._sparse:
+            self._epsilon_matrix = np.diag(self._epsilon_vector)
+
     def observe(self):
         return self._x.copy()
 
@@ -53,6 +69,9 @@ class DTDSD:
 
     def step(self, external_signals): # external_signals must be a matrix with shape (num_pops, num_robots).
         self.set_fitness_vector(external_signals)   # Must be called before set_laplacian_matrix() (for smith dynamics)
+        if self._sparse:
+            self._x = self._x + self._epsilon_vector * self.compute_laplacian_product()
+            return self.observe()
         self.set_laplacian_matrix()                                        # Must be called after set_fitness_vector()
         self._x = self._x + np.dot(self._epsilon_matrix, np.dot(self._laplacian_matrix, self._fitness_vector))
         return self.observe()
@@ -72,6 +91,24 @@ class DTDSD:
         modulated_degree = np.diag(np.sum(modulated_adjacency, 1))
         self._laplacian_matrix = modulated_degree - modulated_adjacency
 
+    def compute_laplacian_product(self):
+        # Sparse version of np.dot(self._laplacian_matrix, self._fitness_vector), evaluated only on the graph edges.
+        # Row i of the product is sum_j modulated_adjacency[i, j]*(f_i - f_j), and the same robot graph is used
+        # by every population, so the edges are evaluated for all the populations (and scenarios, see
+        # BatchDTDSD) at once.
+        rows, cols, weights = self._edge_rows, self._edge_cols, self._edge_weights
+        fitness = self._fitness_vector.reshape(-1, self._np, self._nr)
+        x = self._x.reshape(-1, self._np, self._nr)
+        delta_fitness = fitness[..., rows] - fitness[..., cols]
+        # gamma/|delta| where |delta| > gamma and 1 elsewhere
+        phi = self._gamma_vector/np.maximum(np.abs(delta_fitness), self._gamma_vector)
+        # x_j if f_i > f_j, x_i if f_i < f_j and 0 if they are equal (positive_terms - negative_terms in the dense mode)
+        terms = np.where(delta_fitness > 0, x[..., cols], 0.0) + np.where(delta_fitness < 0, x[..., rows], 0.0)
+        modulated_adjacency = np.clip(terms, -self._gamma_vector, self._gamma_vector)*weights*phi
+        offsets = self._nr*np.arange(x.shape[0]*self._np).reshape(x.shape[0], self._np, 1)
+        entries = (rows + offsets).ravel()
+        return np.bincount(entries, (modulated_adjacency*delta_fitness).ravel(), x.size).reshape(self._x.shape)
+
     def set_adjacency_matrix(self, adjacency_matrix=None):
         if adjacency_matrix is None:
             adj_matrix = np.ones((self._nr, self._nr)) - np.eye(self._nr) # By default use complete graph (full information)
@@ -79,10 +116,32 @@ class DTDSD:
             adj_matrix = adjacency_matrix.reshape(self._nr, self._nr)
 
         adj_matrix = np.clip(adj_matrix - np.eye(self._nr), 0, 1)      # Ensure diagonal is not included
+        if self._sparse:
+            rows, cols = np.nonzero(adj_matrix)
+            self.set_edge_list(np.stack((rows, cols), axis=1), adj_matrix[rows, cols])
+            return
         self._adjacency_matrix = np.kron(np.eye(self._np), adj_matrix) # Extended adjacency for multi-population cases
 
+    def set_edge_list(self, edges, weights=None):
+        # Sparse mode only. edges is an array of shape (num_edges, 2) with the (i, j) robot pairs that communicate
+        # (the non-zero entries of the robots adjacency matrix, listed once each) and weights their values
+        # (1 by default), with shape (num_edges,) or (num_scenarios, num_edges) for BatchDTDSD.
+        # The same graph is used for every population.
+        assert self._sparse, "ERROR: set_edge_list is only available in sparse mode."
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        weights = np.ones(edges.shape[0]) if weights is None else np.clip(np.asarray(weights, dtype=float), 0, 1)
+        used = np.any(weights.reshape(-1, edges.shape[0]) > 0, axis=0)
+        keep = (edges[:, 0] != edges[:, 1]) & used                         # Ensure diagonal is not included
+        order = np.argsort(edges[keep, 0], kind="stable")                 # Row-major order (as in CSR)
+        self._edge_rows = edges[keep, 0][order]
+        self._edge_cols = edges[keep, 1][order]
+        weights = weights[..., keep][..., order]
+        self._edge_weights = weights.reshape(weights.shape[:-1] + (1, -1))  # Broadcast over the populations
+
     def compute_potential_and_fitness_functions(self, x, external_signals):
         # Must return an array of shape (num_robots*num_pops,)
+        if self._sparse:
+            return None, self._h_diagonal*x + external_signals.reshape(np.shape(x))
         x_in = np.reshape(x, (-1, 1))   # Force x to be a column vector
         fitness = np.dot(self._h_matrix, x_in) + external_signals.reshape(self._n, 1)
         return None, fitness.reshape(self._n)
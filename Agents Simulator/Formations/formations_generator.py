@@ -1,25 +1,120 @@
+import functools
 import numpy as np
+from Formations.slot_assignment import auction_assignment
+
+SHAPES = ["line", "triangle", "polygon", "grid"]
+
+
+def get_line_deltas(num_followers):
+    # Vertical line through the leader, the followers alternate below and above it every 2 units
+    distances = 2 * ((np.arange(num_followers) + 2) // 2)
+    signs = np.where(np.arange(num_followers) % 2 == 0, 1, -1)
+    return np.stack((np.zeros(num_followers), signs * distances))
+
+
+def get_triangle_deltas(num_followers):
+    # Filled triangle with the leader at its apex. Row r has r + 1 slots 4 units apart, 2*r units from the apex, and
+    # an incomplete last row is filled from its ends to its center
+    slots = []
+    row = 1
+    while len(slots) < num_followers:
+        xs = sorted(range(-2 * row, 2 * row + 1, 4), key=lambda x: (-abs(x), -x))
+        slots += [(x, 2 * row) for x in xs]
+        row += 1
+    return np.array(slots[:num_followers], dtype=float).reshape(-1, 2).T
+
+
+def get_polygon_deltas(num_followers):
+    # Regular polygon with sides of 4 units and the leader at a vertex. The followers alternate between both sides
+    num_sides = num_followers + 1
+    radius = 2 / np.sin(np.pi / num_sides) if num_sides > 1 else 0
+    vertices = np.arange(1, num_sides)
+    order = np.stack((vertices[:(num_followers + 1) // 2], vertices[::-1][:(num_followers + 1) // 2]), axis=1)
+    order = order.reshape(-1)[:num_followers]
+    angles = -np.pi / 2 + 2 * np.pi * order / num_sides
+    return np.stack((radius * np.cos(angles), radius + radius * np.sin(angles)))
+
+
+def get_grid_deltas(num_followers):
+    # Square grid with 2 units between rows and columns, filled from the leader (at its center) outwards
+    num_columns = int(np.ceil(np.sqrt(num_followers + 1)))
+    num_rows = int(np.ceil((num_followers + 1) / num_columns))
+    xs, ys = np.meshgrid(2 * (np.arange(num_columns) - (num_columns - 1) // 2),
+                         2 * (np.arange(num_rows) - (num_rows - 1) // 2))
+    xs, ys = xs.reshape(-1), ys.reshape(-1)
+    order = np.lexsort((xs, ys, np.arctan2(ys, xs), np.hypot(xs, ys)))
+    return np.stack((xs[order][1:num_followers + 1], ys[order][1:num_followers + 1])).astype(float)
+
+
+@functools.lru_cache(maxsize=None)
+def get_formation_deltas(shape, num_agents, dx, dy):
+    """
+    Followers deltas of a formation of any number of agents. The result is cached per (shape, num_agents, dx, dy)
+    and read-only.
+    :param shape: One of SHAPES
+    :param num_agents: Number of agents (including the leader)
+    :param dx: scale factor for the follower deltas in the x axis
+    :param dy: scale factor for the follower deltas in the y axis
+    :return: numpy.array with shape 3x(num_agents-1), see FormationsGenerator.get_formation
+    """
+    generators = {"line": get_line_deltas, "triangle": get_triangle_deltas, "polygon": get_polygon_deltas,
+                  "grid": get_grid_deltas}
+    assert shape in generators, f"ERROR: Unknown formation shape {shape}, use one of {SHAPES}."
+    deltas = np.zeros((3, num_agents - 1))
+    deltas[:2, :] = generators[shape](num_agents - 1)
+    deltas[0, :] *= dx
+    deltas[1, :] *= dy
+    deltas.setflags(write=False)
+    return deltas
+
+
+def get_min_distance(deltas, chunk_size=1024):
+    """
+    Smallest distance between two slots of a formation, the leader (at delta 0) included.
+    :param deltas: Followers deltas with shape 2x(num_agents-1) or 3x(num_agents-1)
+    :param chunk_size: Number of slots compared with all the others at once
+    :return: distance (inf with a single agent)
+    """
+    slots = np.hstack((np.zeros((2, 1)), deltas[:2, :])).T
+    min_distance = np.inf
+    for start in range(0, slots.shape[0] - 1, chunk_size):
+        # Slot k is compared with the slots after it
+        chunk = slots[start:start + chunk_size]
+        distances = np.hypot(chunk[:, 0:1] - slots[:, 0], chunk[:, 1:2] - slots[:, 1])
+        distances[np.arange(chunk.shape[0]).reshape(-1, 1) + start >= np.arange(slots.shape[0])] = np.inf
+        min_distance = min(min_distance, np.min(distances))
+    return min_distance
 
 
 class FormationsGenerator:
     """
     This class is used to get the leader agent reference position and its followers deltas matrices.
-    This class handles only 5 agents, further work is needed.
+    The line, triangle, polygon and grid shapes work with any number of agents (see get_formation_deltas); with 5
+    agents the line and triangle are the original vertical_line and triangle formations. pentagon is the original
+    5 agents formation, and a polygon for other numbers of agents.
+    Formations that do not fit in the arena are shrunk around the leader (see fit_to_arena).
     """
-    def __init__(self, num_agents, leader_target_x=175, leader_target_y=120, dx=10, dy=10):
+    def __init__(self, num_agents, leader_target_x=175, leader_target_y=120, dx=10, dy=10, max_x=351, max_y=241,
+                 diameter=12):
         """
 
-        :param num_agents: Number of agents (in this moment this variable is not used)
+        :param num_agents: Number of agents
         :param leader_target_x: Leader target x position
         :param leader_target_y: Leader target y position
         :param dx: scale factor for the follower deltas in the x axis
         :param dy: scale factor for the follower deltas in the y axis
+        :param max_x: Width of the arena [cm]
+        :param max_y: Height of the arena [cm]
+        :param diameter: Diameter of the agents [cm]
         """
         self.num_agents = num_agents
         self.leader_target_x = leader_target_x
         self.leader_target_y = leader_target_y
         self.dx = dx
         self.dy = dy
+        self.max_x = max_x
+        self.max_y = max_y
+        self.diameter = diameter
 
     def set_leader_target_position(self, leader_x, leader_y):
         self.leader_target_x = leader_x
@@ -31,23 +126,19 @@ class FormationsGenerator:
         scaled_deltas[1, :] = self.dy*deltas[1, :]
         return scaled_deltas
 
-    def get_vertical_line_formation(self):
-        #self.leader_target_y = 140
-        follower_deltas = np.array([[0, 0, 0, 0],
-                                    [2, -2, 4, -4],
-                                    [0, 0, 0, 0]])
+    def get_shape_formation(self, shape):
         leader_reference = np.array([self.leader_target_x, self.leader_target_y, 0])
-        return leader_reference, self.scale_deltas(follower_deltas)
+        return leader_reference, get_formation_deltas(shape, self.num_agents, self.dx, self.dy)
+
+    def get_vertical_line_formation(self):
+        return self.get_shape_formation("line")
 
     def get_triangle_formation(self):
-        #self.leader_target_y = 120
-        follower_deltas = np.array([[2, -2, 4, -4],
-                                    [2, 2, 4, 4],
-                                    [0, 0, 0, 0]])
-        leader_reference = np.array([self.leader_target_x, self.leader_target_y, 0])
-        return leader_reference, self.scale_deltas(follower_deltas)
+        return self.get_shape_formation("triangle")
 
     def get_pentagon_formation(self):
+        if self.num_agents != 5:
+            return self.get_shape_formation("polygon")
         #self.leader_target_y = 90
         follower_deltas = np.array([[4, -4, 2, -2],
                                     [2, 2, 5, 5],
@@ -55,19 +146,78 @@ class FormationsGenerator:
         leader_reference = np.array([self.leader_target_x, self.leader_target_y, 0])
         return leader_reference, self.scale_deltas(follower_deltas)
 
-    def get_formation(self, formation_name):
+    def get_formation(self, formation_name, followers_positions=None):
         """
 
-        :param formation_name: The name of the target formation
+        :param formation_name: The name of the target formation: vertical_line (or line), triangle, pentagon,
+                               polygon or grid
+        :param followers_positions: Optional current positions of the followers with shape 2x(num_agents-1). If
+                                    given, the followers deltas are reordered so that the total distance from the
+                                    followers to their slots is minimum (see assign_slots)
         :return: tuple(leader_reference, follower_deltas)
             leader_reference: numpy.array [target_x, target_y, target_theta]
             follower_deltas:  numpy.array with shape 3x(num_agents-1) where the ith 3x1 vector
                               contains [delta_x, delta_y, delta_theta] for the ith agent.
         """
-        if formation_name == "vertical_line":
-            return self.get_vertical_line_formation()
+        if formation_name in ["vertical_line", "line"]:
+            formation = self.get_vertical_line_formation()
         elif formation_name == "triangle":
-            return self.get_triangle_formation()
+            formation = self.get_triangle_formation()
         elif formation_name == "pentagon":
-            return self.get_pentagon_formation()
-        return None
+            formation = self.get_pentagon_formation()
+        elif formation_name in SHAPES:
+            formation = self.get_shape_formation(formation_name)
+        else:
+            return None
+        leader_reference, follower_deltas = formation
+        follower_deltas = self.fit_to_arena(leader_reference, follower_deltas)
+        if followers_positions is None:
+            return leader_reference, follower_deltas
+        return leader_reference, self.assign_slots(leader_reference, follower_deltas, followers_positions)
+
+    def fit_to_arena(self, leader_reference, follower_deltas):
+        """
+        Shrinks the follower deltas around the leader until every slot (the leader reference plus its delta) is at
+        least one radius from the walls, so no agent is pushed against a wall instead of reaching its slot.
+        :param leader_reference: numpy.array [target_x, target_y, target_theta]
+        :param follower_deltas: numpy.array with shape 3x(num_agents-1)
+        :return: follower_deltas, or a scaled copy if they do not fit
+        :raise ValueError: if the leader target is outside the arena, or the formation only fits with slots closer
+                           than one diameter
+        """
+        low = 0.5 * self.diameter
+        high_x, high_y = self.max_x - low, self.max_y - low
+        leader_x, leader_y = leader_reference[0], leader_reference[1]
+        if not (low <= leader_x <= high_x and low <= leader_y <= high_y):
+            raise ValueError(f"ERROR: The leader target ({leader_x}, {leader_y}) is outside the arena.")
+        scale = 1.0
+        for deltas, leader, high in ((follower_deltas[0, :], leader_x, high_x),
+                                     (follower_deltas[1, :], leader_y, high_y)):
+            if deltas.shape[0] > 0 and np.max(deltas) > 0:
+                scale = min(scale, (high - leader) / np.max(deltas))
+            if deltas.shape[0] > 0 and np.min(deltas) < 0:
+                scale = min(scale, (leader - low) / -np.min(deltas))
+        if scale == 1.0:
+            return follower_deltas
+        min_distance = scale * get_min_distance(follower_deltas)
+        if min_distance < self.diameter:
+            raise ValueError(f"ERROR: The formation of {self.num_agents} agents does not fit in the "
+                             f"{self.max_x}x{self.max_y} arena: its slots would be "
+                             f"{min_distance:.1f} cm apart, less than the agents diameter.")
+        scaled_deltas = follower_deltas.copy()
+        scaled_deltas[:2, :] *= scale
+        return scaled_deltas
+
+    def assign_slots(self, leader_reference, follower_deltas, followers_positions):
+        """
+        Reorders the follower deltas so that the sum of the distances from every follower to its slot (the leader
+        reference plus its delta) is minimum, with the auction algorithm.
+        :param leader_reference: numpy.array [target_x, target_y, target_theta]
+        :param follower_deltas: numpy.array with shape 3x(num_agents-1)
+        :param followers_positions: Current positions of the followers with shape 2x(num_agents-1)
+        :return: reordered follower deltas
+        """
+        slots = np.reshape(leader_reference[:2], (2, 1)) + follower_deltas[:2, :]
+        costs = np.hypot(followers_positions[0, :].reshape(-1, 1) - slots[0, :],
+                         followers_positions[1, :].reshape(-1, 1) - slots[1, :])
+        return follower_deltas[:, auction_assignment(costs)]
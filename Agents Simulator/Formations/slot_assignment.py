@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def auction_assignment(costs, tolerance=1e-3, scaling_factor=5):
+    """
+    Solves the linear assignment problem (every agent gets one slot and the sum of the costs is minimum) with the
+    auction algorithm of Bertsekas, with epsilon scaling and all the unassigned agents bidding at once.
+    The total cost is at most tolerance above the optimum.
+    :param costs: Square cost matrix with shape (num_agents, num_slots)
+    :param tolerance: Maximum difference between the total cost and the optimum
+    :param scaling_factor: Factor by which epsilon is divided between auction rounds
+    :return: array with the slot of every agent
+    """
+    costs = np.asarray(costs, dtype=float)
+    num_agents, num_slots = costs.shape
+    assert num_agents == num_slots, "ERROR: The cost matrix must be square."
+    if num_agents <= 1:
+        return np.zeros(num_agents, dtype=int)
+    benefits = -costs
+    prices = np.zeros(num_slots)
+    final_epsilon = tolerance / num_agents
+    epsilon = max(np.max(benefits) - np.min(benefits), final_epsilon) / scaling_factor
+    while True:
+        slot_owner = np.full(num_slots, -1)
+        agent_slot = np.full(num_agents, -1)
+        unassigned = np.arange(num_agents)
+        while unassigned.shape[0] > 0:
+            values = benefits[unassigned] - prices
+            rows = np.arange(unassigned.shape[0])
+            best_slots = np.argmax(values, axis=1)
+            best_values = values[rows, best_slots]
+            values[rows, best_slots] = -np.inf
+            second_values = np.max(values, axis=1)
+            bids = prices[best_slots] + best_values - second_values + epsilon
+            # The highest bid for every slot wins it and its previous owner becomes unassigned
+            order = np.lexsort((bids, best_slots))
+            last_bid = np.append(best_slots[order][1:] != best_slots[order][:-1], True)
+            winners = order[last_bid]
+            slots = best_slots[winners]
+            previous_owners = slot_owner[slots]
+            agent_slot[previous_owners[previous_owners >= 0]] = -1
+            slot_owner[slots] = unassigned[winners]
+            agent_slot[unassigned[winners]] = slots
+            prices[slots] = bids[winners]
+            unassigned = np.nonzero(agent_slot < 0)[0]
+        if epsilon <= final_epsilon:
+            return agent_slot
+        epsilon = max(epsilon / scaling_factor, final_epsilon)
@@ -0,0 +1,112 @@
+import numpy as np
+from Agents.agents import Agents
+from Controllers.dt_dsd import DTDSD
+from Formations.formations_generator import FormationsGenerator
+
+
+class Engine:
+    """
+    Qt-free formation simulation: the DTDSD controller computes the agents references and the agents follow them.
+    The Simulator QThread wraps this class for the UI; without the UI it runs as fast as possible with run_until.
+    """
+    def __init__(self, num_agents=5, formation_name="vertical_line", adjacency_matrix=None, initial_positions=None):
+        """
+
+        :param num_agents: Number of agents
+        :param formation_name: Name of the target formation (see FormationsGenerator.get_formation)
+        :param adjacency_matrix: Communication graph of the agents. By default every agent talks to every other agent
+        :param initial_positions: Initial agents poses with shape (3, num_agents). By default a horizontal line
+        """
+        self.num_agents = num_agents
+        self.formation_name = formation_name
+        if adjacency_matrix is None:
+            adjacency_matrix = np.ones((num_agents, num_agents)) - np.eye(num_agents)
+        self.adjacency_matrix = np.array(adjacency_matrix, dtype=float)
+        if initial_positions is None:
+            initial_positions = np.zeros((3, num_agents))
+            initial_positions[0, :] = np.linspace(60, 300, num_agents)
+            initial_positions[1, :] = 130
+        self.initial_positions = np.array(initial_positions, dtype=float)
+
+        self.agents = Agents(self.num_agents)
+        self.gammas = [self.agents.max_x, self.agents.max_y]
+        self.controller = DTDSD(num_robots=self.num_agents, num_populations=2, epsilon=self.get_epsilons(),
+                                gamma=self.gammas)
+        self.controller.set_adjacency_matrix(self.adjacency_matrix)
+        self.t = 0
+        self.running = False
+        self.formation_generator = FormationsGenerator(self.num_agents, max_x=self.agents.max_x,
+                                                       max_y=self.agents.max_y, diameter=self.agents.diameter)
+        # Reorder the formation slots when a run starts so the followers travel the least (see
+        # FormationsGenerator.assign_slots). With False follower i always takes slot i
+        self.assign_slots = True
+        self.leader_reference, self.followers_deltas = None, None
+        self.reset()
+
+    def reset(self):
+        self.t = 0
+        self.agents.reset(initial_positions=self.initial_positions.copy())
+        x0 = self.agents.agents_positions[:2, :].copy()
+        x0[:, 0] = self.num_agents*np.array(self.gammas)
+        self.controller.reset(x0=x0.reshape(-1))
+
+    def get_epsilons(self):
+        # Every neighbour adds up to epsilon*gamma^2 to the change of a reference in one step, so the step-size that
+        # is stable for the 5 agents complete graph (4 neighbours per agent) is divided by the number of neighbours
+        # in larger graphs. Without it the references of complete graphs of 10 or more agents diverge
+        max_degree = np.max(np.sum(self.adjacency_matrix > 0, axis=1))
+        scale = min(1.0, 4 / max_degree) if max_degree > 0 else 1.0
+        return [scale * (1 - 1e-3) * 1 / (2 * self.gammas[0]), scale * (1 - 1e-3) * 1 / (2 * self.gammas[1])]
+
+    def set_adjacency_matrix(self, adjacency_matrix):
+        self.adjacency_matrix = np.array(adjacency_matrix, dtype=float)
+        self.controller.set_adjacency_matrix(self.adjacency_matrix)
+        self.controller.set_step_size(self.get_epsilons())
+
+    def step(self):
+        """
+        Advances the simulation one step. The formation must be loaded (run_until loads it)
+        :return: agents poses with shape (3, num_agents)
+        """
+        leader_position = self.agents.agents_positions[:2, 0].reshape(2, 1)
+        controller_input = np.hstack((-leader_position, self.followers_deltas[:2, :]))
+        references = self.controller.step(controller_input).reshape(2, self.num_agents)
+        # reset leader reference
+        references[:, 0] = self.leader_reference[:2]
+        # add angle zeros
+        references = np.vstack((references, np.zeros((1, self.num_agents))))
+        self.agents.step(references)
+        self.t += 1
+        return self.agents.agents_positions
+
+    def run_until(self, max_steps=None, tolerance=1e-3, callback=None, callback_every=1):
+        """
+        Runs the simulation until the agents stop moving, max_steps is reached or stop() is called.
+
+        :param max_steps: Value of self.t at which the simulation stops (None to only stop at convergence)
+        :param tolerance: The agents have converged when no coordinate of their poses changed more than
+                          tolerance in the last step
+        :param callback: Optional function called with the agents poses every callback_every steps
+        :param callback_every: Number of steps between callback calls
+        :return: "converged", "max_steps" or "stopped"
+        """
+        self.running = True
+        followers_positions = self.agents.agents_positions[:2, 1:] if self.assign_slots else None
+        self.leader_reference, self.followers_deltas = self.formation_generator.get_formation(self.formation_name,
+                                                                                              followers_positions)
+        last_positions = self.agents.agents_positions.copy()
+        while self.running:
+            positions = self.step()
+            if callback is not None and self.t % callback_every == 0:
+                callback(positions)
+            if np.max(np.abs(positions - last_positions)) <= tolerance:
+                self.running = False
+                return "converged"
+            if max_steps is not None and self.t >= max_steps:
+                self.running = False
+                return "max_steps"
+            np.copyto(last_positions, positions)
+        return "stopped"
+
+    def stop(self):
+        self.running = False
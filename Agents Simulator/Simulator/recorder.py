@@ -0,0 +1,97 @@
+import os
+import json
+import numpy as np
+
+MAGIC = b"AGENTRAJ"
+# The data starts at a multiple of ALIGNMENT bytes
+ALIGNMENT = 64
+
+
+class TrajectoryRecorder:
+    """
+    Appends the agents poses and landmarks of every step to a preallocated memory-mapped file.
+    File layout: MAGIC, the header size as a little endian uint64, a JSON header padded with spaces and the data, a
+    float64 array with shape (max_steps, 2, 3, num_agents) whose [:, 0] are the poses and [:, 1] the landmarks.
+    The header holds the formation, the adjacency matrix, the seed, the number of agents, the capacity and the number
+    of recorded steps, and is rewritten by flush and close. close truncates the file to the recorded steps.
+    """
+    def __init__(self, path, num_agents, max_steps, formation_name, adjacency_matrix, seed=None):
+        """
+
+        :param path: Path of the file
+        :param num_agents: Number of agents
+        :param max_steps: Maximum number of recorded steps (including the initial poses)
+        :param formation_name: Name of the target formation
+        :param adjacency_matrix: Communication graph of the agents
+        :param seed: Seed of the random numbers used to set up the run, if any
+        """
+        self.path = path
+        self.header = {"version": 1, "num_agents": int(num_agents), "capacity": int(max_steps), "steps": 0,
+                       "formation": formation_name, "adjacency_matrix": np.asarray(adjacency_matrix).tolist(),
+                       "seed": seed}
+        # The header space is computed with the largest step count, so the header always fits when it is rewritten
+        header_size = len(self.encode_header(max_steps))
+        self.offset = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+        self.header_size = self.offset - len(MAGIC) - 8
+        with open(path, "wb") as file:
+            file.write(MAGIC + np.uint64(self.header_size).tobytes())
+        self.data = np.memmap(path, dtype=np.float64, mode="r+", offset=self.offset,
+                              shape=(max_steps, 2, 3, num_agents))
+        self.steps = 0
+        self.flush()
+
+    def encode_header(self, steps):
+        return json.dumps(dict(self.header, steps=int(steps))).encode()
+
+    def append(self, agents_positions, landmarks):
+        """
+        Records one step.
+        :param agents_positions: Agents poses with shape (3, num_agents)
+        :param landmarks: Agents landmarks with shape (3, num_agents)
+        :return:
+        """
+        assert self.steps < self.data.shape[0], "ERROR: The recording is full."
+        self.data[self.steps, 0] = agents_positions
+        self.data[self.steps, 1] = landmarks
+        self.steps += 1
+
+    def flush(self):
+        self.data.flush()
+        self.header["steps"] = self.steps
+        with open(self.path, "r+b") as file:
+            file.seek(len(MAGIC) + 8)
+            file.write(self.encode_header(self.steps).ljust(self.header_size))
+
+    def close(self):
+        self.header["capacity"] = self.steps
+        self.flush()
+        del self.data
+        os.truncate(self.path, self.offset + self.steps * 2 * 3 * self.header["num_agents"] * 8)
+
+
+class Trajectory:
+    """
+    Read-only view of a file written by TrajectoryRecorder. positions and landmarks are memory maps with shape
+    (steps, 3, num_agents): indexing a step reads only that step from disk and returns a view without copies.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            assert file.read(len(MAGIC)) == MAGIC, "ERROR: The file is not an agents trajectory."
+            header_size = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(file.read(header_size))
+        self.path = path
+        self.num_agents = self.header["num_agents"]
+        self.steps = self.header["steps"]
+        self.formation_name = self.header["formation"]
+        self.adjacency_matrix = np.array(self.header["adjacency_matrix"])
+        self.seed = self.header["seed"]
+        if self.steps == 0:
+            self.data = np.zeros((0, 2, 3, self.num_agents))
+        else:
+            self.data = np.memmap(path, dtype=np.float64, mode="r", offset=len(MAGIC) + 8 + header_size,
+                                  shape=(self.steps, 2, 3, self.num_agents))
+        self.positions = self.data[:, 0]
+        self.landmarks = self.data[:, 1]
+
+    def __len__(self):
+        return self.steps
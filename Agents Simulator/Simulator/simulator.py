@@ -1,10 +1,8 @@
 import time
-import copy
 import numpy as np
-from Agents.agents import Agents
-from Controllers.dt_dsd import DTDSD
+from Simulator.engine import Engine
+from Simulator.recorder import TrajectoryRecorder
 from PyQt5.QtCore import QThread, pyqtSignal
-from Formations.formations_generator import FormationsGenerator
 
 
 class Simulator(QThread):
@@ -14,69 +12,106 @@ class Simulator(QThread):
 
     def __init__(self):
         super(Simulator, self).__init__()
-        self.running = False
-        self.num_agents = 5
         self.simulation_steps = 350
-        self.formation_name = "vertical_line"
-
-        self.adjacency_matrix = np.array([[0., 1., 1., 1., 1.],
-                                          [1., 0., 1., 1., 1.],
-                                          [1., 1., 0., 1., 1.],
-                                          [1., 1., 1., 0., 1.],
-                                          [1., 1., 1., 1., 0.]])
-
-        self.initial_positions = np.array([[60., 120., 180., 240., 300.],
-                                           [130., 130., 130., 130., 130.],
-                                           [0., 0., 0., 0., 0.]])
-        self.agents = Agents(self.num_agents)
-        self.gammas = [self.agents.max_x, self.agents.max_y]
-        epsilons = [(1 - 1e-3) * 1 / (2 * self.gammas[0]), (1 - 1e-3) * 1 / (2 * self.gammas[1])]
-        self.controller = DTDSD(num_robots=self.num_agents, num_populations=2, epsilon=epsilons, gamma=self.gammas)
-        self.controller.set_adjacency_matrix(self.adjacency_matrix)
-        self.t = 0
-        self.formation_generator = FormationsGenerator(self.num_agents)
-        self.leader_reference, self.followers_deltas = None, None
+        # Pause between steps so the UI shows the simulation in real time [s]. With 0 the simulation is not throttled
+        self.step_delay = 0.01
+        # Minimum time between two published frames [s], usually one refresh of the display
+        self.frame_interval = 1 / 60
+        self.last_frame_time = -np.inf
+        # A frame was emitted and the UI has not taken it yet (see frame_received). Frames are skipped meanwhile, so
+        # only the latest snapshot crosses to the UI thread and frames never queue up behind a slow repaint
+        self.frame_pending = False
+        # TrajectoryRecorder of the next run, see start_recording
+        self.recorder = None
+        self.engine = Engine(num_agents=5, formation_name="vertical_line",
+                             adjacency_matrix=np.array([[0., 1., 1., 1., 1.],
+                                                        [1., 0., 1., 1., 1.],
+                                                        [1., 1., 0., 1., 1.],
+                                                        [1., 1., 1., 0., 1.],
+                                                        [1., 1., 1., 1., 0.]]),
+                             initial_positions=np.array([[60., 120., 180., 240., 300.],
+                                                         [130., 130., 130., 130., 130.],
+                                                         [0., 0., 0., 0., 0.]]))
         self.reset_simulation()
 
+    @property
+    def agents(self):
+        return self.engine.agents
+
+    @property
+    def running(self):
+        return self.engine.running
+
+    @property
+    def formation_name(self):
+        return self.engine.formation_name
+
+    @formation_name.setter
+    def formation_name(self, formation_name):
+        self.engine.formation_name = formation_name
+
+    @property
+    def adjacency_matrix(self):
+        return self.engine.adjacency_matrix
+
     def run(self):
+        result = self.engine.run_until(self.simulation_steps, callback=self.publish_step)
+        self.publish_frame(self.agents.agents_positions, force=True)
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if result != "stopped":
+            self.engine.t = 0
+            self.simulation_finished_signal.emit()
+
+    def publish_step(self, agents_positions):
+        if self.recorder is not None:
+            self.recorder.append(agents_positions, self.agents.landmarks)
+        self.publish_frame(agents_positions)
+        if self.step_delay > 0:
+            time.sleep(self.step_delay)
+
+    def publish_frame(self, agents_positions, force=False):
+        """
+        Emits a copy of the agents poses if the UI took the previous frame and frame_interval passed since it.
+        :param agents_positions: Agents poses with shape (3, num_agents)
+        :param force: Emit even if a frame is pending or frame_interval did not pass (used for the last frame)
+        :return:
+        """
+        now = time.perf_counter()
+        if not force and (self.frame_pending or now - self.last_frame_time < self.frame_interval):
+            return
+        self.last_frame_time = now
+        self.frame_pending = True
+        self.agent_positions_signal.emit(agents_positions.copy())
+
+    def frame_received(self):
+        self.frame_pending = False
 
-        self.running = True
-        self.leader_reference, self.followers_deltas = self.formation_generator.get_formation(self.formation_name)
-        last_positions = copy.deepcopy(self.agents.agents_positions)
-        while self.running:
-            leader_position = self.agents.agents_positions[:2, 0].reshape(2, 1)
-            controller_input = np.hstack((-leader_position, self.followers_deltas[:2, :]))
-            references = self.controller.step(controller_input).reshape(2, self.num_agents)
-            # reset leader reference
-            references[:, 0] = self.leader_reference[:2]
-            # add angle zeros
-            references = np.vstack((references, np.zeros((1, self.num_agents))))
-            self.agents.step(references)
-            self.agent_positions_signal.emit(self.agents.agents_positions)
-            self.t += 1
-            if (self.t == self.simulation_steps) or (np.all(last_positions == self.agents.agents_positions)):
-                self.t = 0
-                self.stop()
-                self.simulation_finished_signal.emit()
-            last_positions = copy.deepcopy(self.agents.agents_positions)
-            time.sleep(0.01)
+    def start_recording(self, path):
+        """
+        Records the next run (from the current poses) to a trajectory file, see Simulator/recorder.py.
+        :param path: Path of the file
+        :return:
+        """
+        self.recorder = TrajectoryRecorder(path, self.engine.num_agents, self.simulation_steps - self.engine.t + 1,
+                                           self.formation_name, self.adjacency_matrix)
+        self.recorder.append(self.agents.agents_positions, self.agents.landmarks)
 
     def stop(self):
-        self.running = False
+        self.engine.stop()
 
     def reset_simulation(self):
-        self.agents.reset(initial_positions=self.initial_positions)
-        x0 = self.agents.agents_positions[:2, :].copy()
-        x0[:, 0] = self.num_agents*np.array(self.gammas)
-        self.controller.reset(x0=x0.reshape(-1))
+        self.engine.reset()
 
     def publish_positions(self):
         self.agent_positions_signal.emit(self.agents.agents_positions)
 
     def update_adjacency_matrix(self, edge_name):
         i, j = [int(dig)-1 for dig in list(edge_name)]
-        self.adjacency_matrix[i][j] = 1 - self.adjacency_matrix[i][j]
-        self.adjacency_matrix[j][i] = 1 - self.adjacency_matrix[j][i]
-        self.controller.set_adjacency_matrix(self.adjacency_matrix)
+        adjacency_matrix = self.engine.adjacency_matrix
+        adjacency_matrix[i][j] = 1 - adjacency_matrix[i][j]
+        adjacency_matrix[j][i] = 1 - adjacency_matrix[j][i]
+        self.engine.set_adjacency_matrix(adjacency_matrix)
         print("Adjacency Matrix updated to: ")
-        print(self.adjacency_matrix)
\ No newline at end of file
+        print(adjacency_matrix)
@@ -0,0 +1,191 @@
+import json
+import time
+import argparse
+import numpy as np
+from Agents.agents import Agents
+from Controllers.dt_dsd import DTDSD
+from Simulator.engine import Engine
+
+# Benchmarks of the simulator core, without the UI (PyQt5 is not imported). Run from the "Agents Simulator" folder:
+#   python -m Tests.benchmarks            compares with the baselines and fails if a case is slower than the tolerance
+#   python -m Tests.benchmarks --update   measures and stores the baselines
+# Times are stored relative to a fixed numpy workload (see calibrate), so the baselines can be compared on machines
+# of different speed. The baselines are only comparable with the same case list, numpy version and thread settings.
+
+BASELINES = "Tests/benchmark_baselines.json"
+
+
+def measure(function, prepare=None, min_time=0.05, repeats=5):
+    """
+    Best time of one call of function. Every repeat calls it as many times as needed to take at least min_time.
+    :param function: Function without arguments to measure
+    :param prepare: Optional function called (without being measured) before every call, to restore the state
+    :param min_time: Minimum time of every repeat [s]
+    :param repeats: Number of repeats
+    :return: time of one call [s]
+    """
+    best = np.inf
+    for _ in range(repeats):
+        elapsed, calls = 0.0, 0
+        while elapsed < min_time:
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter()
+            function()
+            elapsed += time.perf_counter() - start
+            calls += 1
+        best = min(best, elapsed / calls)
+    return best
+
+
+def calibrate():
+    # Reference workload with the operations the simulator uses the most: sorting, element-wise math and a product
+    rng = np.random.default_rng(0)
+    values = rng.random(200000)
+    matrix = rng.random((200, 200))
+    return measure(lambda: (np.sort(values), np.arctan2(values, values[::-1]), matrix @ matrix))
+
+
+def make_agents(num_agents, density, seed=0):
+    """
+    Agents at random poses in an arena whose size gives the density.
+    :param num_agents: Number of agents
+    :param density: Fraction of the arena covered by the agents
+    :param seed: Seed of the poses and landmarks
+    :return: Agents
+    """
+    agents = Agents(num_agents)
+    scale = np.sqrt(num_agents * np.pi * (0.5 * agents.diameter) ** 2 / (density * agents.max_x * agents.max_y))
+    agents.max_x, agents.max_y = scale * agents.max_x, scale * agents.max_y
+    agents.lim_x = agents.max_x - 0.5 * agents.diameter
+    agents.lim_y = agents.max_y - 0.5 * agents.diameter
+    np.random.seed(seed)
+    agents.reset()
+    return agents
+
+
+def bench_agents_step():
+    results = {}
+    for num_agents in [5, 100, 1000, 10000]:
+        for density in [0.05, 0.3]:
+            for integrator in ["arc", "euler"]:
+                # The dense broad phase builds several n x n matrices in every collision check
+                for broad_phase in ["dense", "grid"] if num_agents <= 1000 else ["grid"]:
+                    agents = make_agents(num_agents, density)
+                    agents.integrator, agents.broad_phase = integrator, broad_phase
+                    initial_positions, references = agents.agents_positions.copy(), agents.landmarks
+                    in_contact = agents.in_contact.copy()
+
+                    # Every step starts from the same poses, so the agents do not converge during the measure
+                    def prepare():
+                        np.copyto(agents.agents_positions, initial_positions)
+                        agents.in_contact = in_contact.copy()
+                    results[f"agents_step/n={num_agents}/density={density}/integrator={integrator}/"
+                            f"broad_phase={broad_phase}"] = measure(lambda: agents.step(references), prepare)
+    return results
+
+
+def bench_collisions():
+    results = {}
+    for num_agents in [5, 100, 1000, 10000]:
+        agents = make_agents(num_agents, 0.3)
+        agents.broad_phase = "grid"
+        initial_positions = agents.agents_positions.copy()
+        prepare = lambda: np.copyto(agents.agents_positions, initial_positions)
+        if num_agents <= 1000:
+            # The dense check builds several n x n matrices
+            results[f"check_collisions/n={num_agents}"] = measure(agents.check_collisions)
+        results[f"find_collision_pairs/n={num_agents}"] = measure(agents.find_collision_pairs)
+        results[f"resolve_collisions/n={num_agents}"] = measure(agents.resolve_collisions, prepare)
+    return results
+
+
+def bench_dt_dsd_step():
+    results = {}
+    rng = np.random.default_rng(0)
+    for num_robots in [5, 50, 200, 1000]:
+        for num_populations in [1, 2]:
+            for edge_probability in [0.01, 0.1, 0.5, 1.0]:
+                # Path graph plus random edges, so the graph is connected
+                adjacency_matrix = np.triu(rng.random((num_robots, num_robots)) < edge_probability, 1).astype(float)
+                adjacency_matrix[np.arange(num_robots - 1), np.arange(1, num_robots)] = 1
+                adjacency_matrix = adjacency_matrix + adjacency_matrix.T
+                gammas = [351, 241][:num_populations]
+                epsilons = [1 / (2 * gamma * max(1, np.max(np.sum(adjacency_matrix, axis=1)) / 4)) for gamma in gammas]
+                x0 = rng.random(num_robots * num_populations) * num_robots
+                signals = rng.random((num_populations, num_robots))
+                # The dense mode costs the same for every graph, its n x n matrices are only built up to 200 robots.
+                # The sparse mode (edge list) grows with the number of edges
+                for sparse in [False, True] if num_robots <= 200 else [True]:
+                    controller = DTDSD(num_robots=num_robots, num_populations=num_populations, epsilon=epsilons,
+                                       gamma=gammas, sparse=sparse)
+                    controller.set_adjacency_matrix(adjacency_matrix)
+                    controller.reset(x0=x0)
+                    results[f"dt_dsd_step/n={num_robots}/populations={num_populations}/edges={edge_probability}/"
+                            f"sparse={sparse}"] = measure(lambda: controller.step(signals))
+    return results
+
+
+def bench_convergence():
+    results = {}
+    for formation_name, num_agents in [("vertical_line", 5), ("triangle", 5), ("pentagon", 5), ("grid", 50)]:
+        engine = Engine(num_agents=num_agents, formation_name=formation_name)
+
+        def run():
+            engine.reset()
+            engine.run_until(1000)
+        results[f"convergence/{formation_name}/n={num_agents}"] = measure(run, repeats=3)
+    return results
+
+
+BENCHMARKS = {"agents_step": bench_agents_step, "collisions": bench_collisions, "dt_dsd_step": bench_dt_dsd_step,
+              "convergence": bench_convergence}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulator core")
+    parser.add_argument("--update", action="store_true", help="Store the measures as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="A case fails if it is more than this fraction slower than its baseline")
+    parser.add_argument("--baselines", default=BASELINES, help="Path of the JSON baselines")
+    parser.add_argument("--only", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        help="Benchmarks to run")
+    args = parser.parse_args()
+
+    calibration = calibrate()
+    times = {}
+    for name in args.only:
+        times.update(BENCHMARKS[name]())
+    # The machine load can change during the run, the fastest calibration is the closest to the unloaded machine
+    calibration = min(calibration, calibrate())
+    relative_times = {case: elapsed / calibration for case, elapsed in times.items()}
+
+    if args.update:
+        baselines = {}
+        try:
+            with open(args.baselines) as file:
+                baselines = json.load(file)["cases"]
+        except FileNotFoundError:
+            pass
+        baselines.update(relative_times)
+        with open(args.baselines, "w") as file:
+            json.dump({"numpy": np.__version__, "cases": baselines}, file, indent=2, sort_keys=True)
+        print(f"{len(relative_times)} baselines stored in {args.baselines}")
+    else:
+        with open(args.baselines) as file:
+            baselines = json.load(file)["cases"]
+        failures = 0
+        for case, relative_time in relative_times.items():
+            baseline = baselines.get(case)
+            if baseline is None:
+                status = "NEW"
+            elif relative_time > (1 + args.tolerance) * baseline:
+                status = "FAIL"
+                failures += 1
+            else:
+                status = "ok"
+            ratio = "" if baseline is None else f"{relative_time / baseline:6.2f}x"
+            print(f"{status:4} {case:70} {times[case] * 1e3:10.3f} ms {ratio}")
+        print(f"{failures} of {len(relative_times)} cases slower than {1 + args.tolerance:.2f}x their baseline")
+        if failures > 0:
+            raise SystemExit(1)
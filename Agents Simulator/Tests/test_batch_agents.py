@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from Agents.agents import Agents
+from Agents.batch_agents import BatchAgents
+
+num_swarms, num_agents, num_steps = 4, 12, 60
+
+
+def make_swarms(seed=0):
+    """
+    A batch and one Agents per swarm with the same poses and landmarks. The swarms are crowded in different ways so
+    they are in contact, near the walls and free at different substeps.
+    :return: tuple (batch, swarms)
+    """
+    rng = np.random.default_rng(seed)
+    batch = BatchAgents(num_swarms, num_agents)
+    # Swarm 0 starts crowded in a corner, the others spread over the arena
+    spreads = np.linspace(0.2, 1.0, num_swarms).reshape(-1, 1)
+    poses = np.zeros((num_swarms, 3, num_agents))
+    poses[:, 0, :] = 6 + spreads * rng.random((num_swarms, num_agents)) * (batch.lim_x - 6)
+    poses[:, 1, :] = 6 + spreads * rng.random((num_swarms, num_agents)) * (batch.lim_y - 6)
+    poses[:, 2, :] = rng.random((num_swarms, num_agents)) * 2 * np.pi
+    landmarks = np.zeros((num_swarms, 3, num_agents))
+    landmarks[:, 0, :] = 6 + rng.random((num_swarms, num_agents)) * (batch.lim_x - 6)
+    landmarks[:, 1, :] = 6 + rng.random((num_swarms, num_agents)) * (batch.lim_y - 6)
+    # The landmarks of the last swarm are on a wall
+    landmarks[-1, 0, :] = batch.lim_x
+    batch.reset(poses, landmarks)
+    swarms = []
+    for swarm in range(num_swarms):
+        agents = Agents(num_agents)
+        agents.broad_phase = "grid"
+        agents.reset(poses[swarm].copy(), landmarks[swarm].copy())
+        swarms.append(agents)
+    return batch, swarms
+
+
+def fused_step(agents, references):
+    # Agents.step with the "arc" integrator in every step, also in the steps that start in contact
+    agents.set_landmarks(references)
+    v, w = agents.compute_low_level_control()
+    agents.dynamics_fused(np.clip(v, -agents.max_v, agents.max_v), np.clip(w, -agents.max_w, agents.max_w))
+
+
+def test_dynamics_fused_matches_separate_swarms():
+    batch, swarms = make_swarms()
+    references = batch.swarm_landmarks.copy()
+    contacts = np.zeros(num_swarms, dtype=int)
+    for _ in range(num_steps):
+        fused_step(batch, references)
+        for swarm, agents in enumerate(swarms):
+            collision_count = agents.collision_count
+            fused_step(agents, references[swarm])
+            contacts[swarm] += agents.collision_count - collision_count
+    for swarm, agents in enumerate(swarms):
+        assert np.allclose(batch.poses[swarm], agents.agents_positions, rtol=0, atol=1e-9), swarm
+    # Every swarm takes the substeps it takes alone, not the ones of the most crowded swarm
+    assert batch.substep_count == sum(agents.substep_count for agents in swarms)
+    # The swarms must have touched, otherwise the test does not check the substeps in contact
+    assert np.all(contacts > 0)
+
+
+@pytest.mark.parametrize("integrator", ["arc", "euler"])
+def test_step_matches_separate_swarms(integrator):
+    # Every swarm chooses "arc" or "euler" from its own contacts, so the batched swarms follow the same trajectories
+    # as separate swarms, also through reset_swarms
+    batch, swarms = make_swarms()
+    batch.integrator = integrator
+    for agents in swarms:
+        agents.integrator = integrator
+    references = batch.swarm_landmarks.copy()
+    rng = np.random.default_rng(1)
+    mixed_steps, substep_count = 0, 0
+    for step in range(num_steps):
+        if step == num_steps // 2:
+            # Swarm 1 restarts crowded in a corner, in contact
+            poses = batch.poses[1:2].copy()
+            poses[0, :2, :] = 6 + 0.1 * rng.random((2, num_agents)) * 100
+            batch.reset_swarms([1], poses, references[1:2])
+            substep_count += swarms[1].substep_count
+            swarms[1].reset(poses[0].copy(), references[1].copy())
+            assert batch.in_contact[1] and swarms[1].in_contact[0]
+        mixed_steps += 0 < np.count_nonzero(batch.in_contact) < num_swarms
+        batch.step(references)
+        for swarm, agents in enumerate(swarms):
+            agents.step(references[swarm])
+        for swarm, agents in enumerate(swarms):
+            assert np.allclose(batch.poses[swarm], agents.agents_positions, rtol=0, atol=1e-9), (step, swarm)
+            assert batch.in_contact[swarm] == agents.in_contact[0], (step, swarm)
+    # reset and reset_swarms restart the collision counts of swarm 1, but not the substep counts of the batch
+    assert np.array_equal(batch.collision_counts, [agents.collision_count for agents in swarms])
+    assert batch.substep_count == substep_count + sum(agents.substep_count for agents in swarms)
+    # Some steps started with only some of the swarms in contact
+    assert mixed_steps > 0
+
+
+def test_check_collisions_not_implemented():
+    batch, _ = make_swarms()
+    with pytest.raises(NotImplementedError):
+        batch.check_collisions()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from Formations.formations_generator import FormationsGenerator, get_min_distance, SHAPES
+
+# Largest number of agents of every shape that fits in the 351x241 arena with the default leader target and deltas
+MAX_AGENTS = {"line": 19, "triangle": 105, "polygon": 30, "grid": 380}
+max_x, max_y, diameter = 351, 241, 12
+
+
+def get_slots(leader_reference, follower_deltas):
+    return np.hstack((np.zeros((2, 1)), follower_deltas[:2, :])) + leader_reference[:2].reshape(2, 1)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_slots_inside_arena(shape):
+    for num_agents in range(2, MAX_AGENTS[shape] + 1):
+        leader_reference, follower_deltas = FormationsGenerator(num_agents).get_formation(shape)
+        slots = get_slots(leader_reference, follower_deltas)
+        assert np.all(slots >= 0.5 * diameter - 1e-9), (shape, num_agents)
+        assert np.all(slots[0, :] <= max_x - 0.5 * diameter + 1e-9), (shape, num_agents)
+        assert np.all(slots[1, :] <= max_y - 0.5 * diameter + 1e-9), (shape, num_agents)
+        assert get_min_distance(follower_deltas) >= diameter - 1e-9, (shape, num_agents)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_too_many_agents(shape):
+    with pytest.raises(ValueError):
+        FormationsGenerator(MAX_AGENTS[shape] + 1).get_formation(shape)
+
+
+def test_original_formations_unchanged():
+    generator = FormationsGenerator(5)
+    expected = {"vertical_line": [[0, 0, 0, 0], [2, -2, 4, -4]],
+                "triangle": [[2, -2, 4, -4], [2, 2, 4, 4]],
+                "pentagon": [[4, -4, 2, -2], [2, 2, 5, 5]]}
+    for formation_name, deltas in expected.items():
+        leader_reference, follower_deltas = generator.get_formation(formation_name)
+        assert np.array_equal(leader_reference, [175, 120, 0])
+        assert np.array_equal(follower_deltas[:2, :], 10 * np.array(deltas)), formation_name
+
+
+def test_smaller_arena():
+    # The deltas shrink around the leader in an arena that only fits them scaled, down to one diameter between slots
+    generator = FormationsGenerator(5, leader_target_x=50, leader_target_y=30, max_x=100, max_y=100)
+    leader_reference, follower_deltas = generator.get_formation("vertical_line")
+    slots = get_slots(leader_reference, follower_deltas)
+    assert np.all(slots >= 6 - 1e-9) and np.all(slots <= 94 + 1e-9)
+    assert np.isclose(get_min_distance(follower_deltas), 12)
+    generator.set_leader_target_position(50, 20)
+    with pytest.raises(ValueError):
+        generator.get_formation("vertical_line")
+    generator.set_leader_target_position(400, 120)
+    with pytest.raises(ValueError):
+        generator.get_formation("vertical_line")
@@ -58,6 +58,7 @@ class MyWindow(QtWidgets.QWidget):
         self.simulator.formation_name = target_simulation
 
     def slot_update_agents_position(self, agents_position):
+        self.simulator.frame_received()
         self.canvas.draw_agents(agents_position)
 
 
@@ -1,8 +1,12 @@
+import os
+import time
 from canvas import Canvas
 from UI.scene import Scene
-from PyQt5 import uic, QtGui, QtCore
+from PyQt5 import uic, QtGui, QtCore, QtWidgets
 from Simulator.simulator import Simulator
-from PyQt5.QtWidgets import QMainWindow, QPushButton, QRadioButton, QGraphicsView, QLabel
+from Simulator.recorder import Trajectory
+from PyQt5.QtWidgets import QMainWindow, QPushButton, QRadioButton, QGraphicsView, QLabel, QCheckBox, QSlider, \
+    QFileDialog
 
 
 class UI(QMainWindow):
@@ -16,6 +20,7 @@ class UI(QMainWindow):
                             QtCore.Qt.WindowType.WindowCloseButtonHint |
                             QtCore.Qt.WindowType.WindowMinimizeButtonHint)
         self.simulator = Simulator()
+        self.simulator.frame_interval = 1 / max(QtWidgets.QApplication.primaryScreen().refreshRate(), 1)
         self.simulator.reset_simulation()
 
         self.canvas = self.findChild(Canvas, "canvas")
@@ -38,6 +43,16 @@ class UI(QMainWindow):
         self.simulation_restart_button = self.findChild(QPushButton, "restart_simulation")
         self.simulation_restart_button.clicked.connect(self.slot_restart_simulation)
 
+        self.record_check_box = self.findChild(QCheckBox, "record_simulation")
+        self.load_replay_button = self.findChild(QPushButton, "load_replay")
+        self.load_replay_button.clicked.connect(self.slot_load_replay)
+        self.replay_slider = self.findChild(QSlider, "replay_slider")
+        self.replay_slider.valueChanged.connect(self.slot_seek_replay)
+        self.play_replay_button = self.findChild(QPushButton, "play_replay")
+        self.play_replay_button.clicked.connect(self.slot_play_replay)
+        self.replay_timer = QtCore.QTimer(self)
+        self.replay_timer.timeout.connect(self.slot_replay_tick)
+
         self.scene = Scene()
         self.graph_canvas_view = self.findChild(QGraphicsView, "graph_canvas")
         self.graph_canvas_view.setScene(self.scene)
@@ -56,12 +71,20 @@ class UI(QMainWindow):
 
     def slot_restart_simulation(self):
         print("Restarting simulation")
+        self.stop_replay()
         self.simulator.reset_simulation()
         self.simulator.publish_positions()
 
     def slot_start_simulation(self):
         print("Starting simulation")
+        self.stop_replay()
+        if self.record_check_box.isChecked():
+            os.makedirs("Recordings", exist_ok=True)
+            path = f"Recordings/{self.simulator.formation_name}_{time.strftime('%Y%m%d_%H%M%S')}.traj"
+            self.simulator.start_recording(path)
+            self.statusBar().showMessage(f"Recording to {path}")
         self.canvas.draw_agents(self.simulator.agents.agents_positions)
+        self.load_replay_button.setEnabled(False)
         self.simulation_start_button.setEnabled(False)
         self.simulation_restart_button.setEnabled(False)
         self.simulation_start_button.setStyleSheet("background-color: gray")
@@ -75,8 +98,10 @@ class UI(QMainWindow):
         self.simulation_start_button.setStyleSheet("background-color: white")
         self.simulation_restart_button.setEnabled(True)
         self.simulation_restart_button.setStyleSheet("background-color: white")
+        self.load_replay_button.setEnabled(True)
 
     def slot_update_agents_position(self, agents_position):
+        self.simulator.frame_received()
         self.canvas.draw_agents(agents_position)
 
     def slot_radio_button_state(self, button):
@@ -86,3 +111,49 @@ class UI(QMainWindow):
             image = QtGui.QPixmap(f"Images/{target_simulation}.png")
             self.formation_label_widget.setPixmap(image)
             self.simulator.formation_name = target_simulation
+
+    def slot_load_replay(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Cargar grabación", "Recordings", "Trayectorias (*.traj)")
+        if not path:
+            return
+        self.stop_replay()
+        trajectory = Trajectory(path)
+        if len(trajectory) == 0:
+            return
+        self.canvas.set_trajectory(trajectory)
+        self.replay_slider.setRange(0, len(trajectory) - 1)
+        self.replay_slider.setValue(0)
+        self.replay_slider.setEnabled(True)
+        self.play_replay_button.setEnabled(True)
+        self.statusBar().showMessage(f"Replay of {os.path.basename(path)}: {trajectory.formation_name}, "
+                                     f"{len(trajectory)} steps")
+
+    def stop_replay(self):
+        self.replay_timer.stop()
+        self.play_replay_button.setText("Reproducir")
+        self.play_replay_button.setEnabled(False)
+        self.replay_slider.setEnabled(False)
+        self.canvas.set_trajectory(None)
+
+    def slot_seek_replay(self, step):
+        if self.canvas.trajectory is not None:
+            self.canvas.seek(step)
+
+    def slot_play_replay(self):
+        if self.replay_timer.isActive():
+            self.replay_timer.stop()
+            self.play_replay_button.setText("Reproducir")
+            return
+        if self.replay_slider.value() == self.replay_slider.maximum():
+            self.replay_slider.setValue(0)
+        # Played back at the pace of the live simulation, but never faster than the display
+        self.replay_timer.start(int(1000 * max(self.simulator.step_delay, self.simulator.frame_interval)))
+        self.play_replay_button.setText("Pausar")
+
+    def slot_replay_tick(self):
+        step = self.replay_slider.value() + 1
+        if step > self.replay_slider.maximum():
+            self.replay_timer.stop()
+            self.play_replay_button.setText("Reproducir")
+            return
+        self.replay_slider.setValue(step)
@@ -1,32 +1,78 @@
+import numpy as np
 from utils import get_agent_colors
 from PyQt5 import QtWidgets, QtGui, QtCore
 
 
 class Canvas(QtWidgets.QWidget):
+    # With more agents than max_colors the colors are repeated, so a frame takes at most max_colors draw calls
+    max_colors = 64
+    # Diameter of the drawn agents [px]
+    agent_size = 8
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.agents_positions = get_agent_colors()
-        self.agent_colors = get_agent_colors()
+        self.agents_positions = None
+        # Replay mode: frames are drawn straight from the memory map of a Trajectory, see set_trajectory
+        self.trajectory = None
+        self.background_brush = QtGui.QBrush(QtCore.Qt.white)
+        self.num_agents = 0
+        # One (pen, polygon, points) group per color, see set_num_agents
+        self.color_groups = []
         print("Canvas loaded ")
 
+    def set_num_agents(self, num_agents):
+        """
+        Builds the pens and point buffers of every color. Agent i gets the color i % num_colors, and the agents
+        of one color are drawn at once as round points of the agent size, whose coordinates are written directly
+        into the memory of a QPolygonF.
+        :param num_agents: Number of agents
+        :return:
+        """
+        self.num_agents = num_agents
+        num_colors = min(num_agents, self.max_colors)
+        agent_colors = get_agent_colors(num_colors)
+        self.color_groups = []
+        for color_id in range(num_colors):
+            pen = QtGui.QPen(agent_colors[color_id])
+            pen.setWidth(self.agent_size + 1)
+            pen.setCapStyle(QtCore.Qt.RoundCap)
+            num_points = len(range(color_id, num_agents, num_colors))
+            polygon = QtGui.QPolygonF(num_points)
+            pointer = polygon.data()
+            pointer.setsize(num_points * 2 * np.dtype(float).itemsize)
+            points = np.frombuffer(pointer, dtype=float).reshape(num_points, 2)
+            self.color_groups.append((pen, polygon, points))
+
     def draw_agents(self, agents_positions):
+        if agents_positions.shape[1] != self.num_agents:
+            self.set_num_agents(agents_positions.shape[1])
         self.agents_positions = agents_positions
         self.update()
 
+    def set_trajectory(self, trajectory):
+        """
+        Enters replay mode and shows the first step of the trajectory.
+        :param trajectory: Simulator.recorder.Trajectory, or None to leave replay mode
+        :return:
+        """
+        self.trajectory = trajectory
+        if trajectory is not None and len(trajectory) > 0:
+            self.seek(0)
+
+    def seek(self, step):
+        # The poses of the step are a view of the memory map, only that step is read from disk
+        self.draw_agents(self.trajectory.positions[step])
+
     def paintEvent(self, event):
         painter = QtGui.QPainter(self)
-        brush = QtGui.QBrush(QtCore.Qt.white)
-        painter.setBrush(brush)
+        painter.setBrush(self.background_brush)
         painter.drawRect(event.rect())
-        pen = QtGui.QPen()
-        pen.setWidth(1)
         if self.agents_positions is not None:
-            num_agents = self.agents_positions.shape[1]
-            for agent_id in range(num_agents):
-                x, y, theta = self.agents_positions[:, agent_id]
-                brush = QtGui.QBrush(self.agent_colors[agent_id])
-                painter.setBrush(brush)
-                pen.setColor(self.agent_colors[agent_id])
+            num_colors = len(self.color_groups)
+            # (x, y) is the top left corner of the square around the agent
+            offset = 0.5 * self.agent_size
+            for color_id, (pen, polygon, points) in enumerate(self.color_groups):
+                points[:, 0] = self.agents_positions[0, color_id::num_colors] + offset
+                points[:, 1] = self.agents_positions[1, color_id::num_colors] + offset
                 painter.setPen(pen)
-                painter.drawEllipse(int(x), int(y), 8, 8)
-
+                painter.drawPoints(polygon)
@@ -0,0 +1,41 @@
+import time
+import argparse
+import numpy as np
+from Simulator.engine import Engine
+from Simulator.recorder import TrajectoryRecorder
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the formation simulation without the UI (PyQt5 is not needed)")
+    parser.add_argument("--formation", default="vertical_line",
+                        choices=["vertical_line", "triangle", "pentagon", "line", "polygon", "grid"],
+                        help="Target formation")
+    parser.add_argument("--num-agents", type=int, default=5, help="Number of agents")
+    parser.add_argument("--fixed-slots", action="store_true",
+                        help="Follower i always takes slot i of the formation (by default the slots are assigned to "
+                             "minimize the followers travel)")
+    parser.add_argument("--max-steps", type=int, default=350, help="Maximum number of simulation steps")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Convergence tolerance [cm]")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of random initial positions (by default the agents start in a horizontal line)")
+    parser.add_argument("--record", default=None, help="Path of a trajectory file to record the run")
+    args = parser.parse_args()
+
+    engine = Engine(num_agents=args.num_agents, formation_name=args.formation)
+    engine.assign_slots = not args.fixed_slots
+    if args.seed is not None:
+        np.random.seed(args.seed)
+        engine.initial_positions = engine.agents.sample_poses(engine.num_agents)
+        engine.reset()
+    callback = None
+    if args.record is not None:
+        recorder = TrajectoryRecorder(args.record, engine.num_agents, args.max_steps + 1, args.formation,
+                                      engine.adjacency_matrix, args.seed)
+        recorder.append(engine.agents.agents_positions, engine.agents.landmarks)
+        callback = lambda agents_positions: recorder.append(agents_positions, engine.agents.landmarks)
+    start = time.perf_counter()
+    result = engine.run_until(args.max_steps, tolerance=args.tolerance, callback=callback)
+    elapsed = time.perf_counter() - start
+    if args.record is not None:
+        recorder.close()
+    print(f"{result} after {engine.t} steps ({elapsed:.3f} s)")
+    print(engine.agents.agents_positions)
@@ -0,0 +1,199 @@
+import csv
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Agents.agents import Agents
+from Simulator.engine import Engine
+
+FORMATIONS = ["vertical_line", "triangle", "pentagon", "line", "polygon", "grid"]
+# Largest number of possible edges whose graphs are all enumerated (2^20 edge sets)
+MAX_ENUMERATED_EDGES = 20
+COLUMNS = ["graph", "edges", "formation", "seed", "result", "steps", "error", "collisions", "seconds"]
+
+# Read-only setup shared by every case of a worker process, see init_worker
+setup = None
+
+
+def get_edge_pairs(num_agents):
+    # Edge k of a graph joins agents rows[k] and columns[k]
+    return np.triu_indices(num_agents, 1)
+
+
+def to_adjacency_matrices(edges, num_agents):
+    """
+    :param edges: Boolean array with shape (num_graphs, num_edges), edge k as in get_edge_pairs
+    :return: adjacency matrices with shape (num_graphs, num_agents, num_agents)
+    """
+    rows, columns = get_edge_pairs(num_agents)
+    adjacency_matrices = np.zeros((edges.shape[0], num_agents, num_agents))
+    adjacency_matrices[:, rows, columns] = edges
+    adjacency_matrices[:, columns, rows] = edges
+    return adjacency_matrices
+
+
+def is_connected(adjacency_matrices):
+    # Agent 0 reaches every agent of a connected graph in at most num_agents - 1 hops
+    num_agents = adjacency_matrices.shape[-1]
+    reached = np.zeros(adjacency_matrices.shape[:-1], dtype=bool)
+    reached[:, 0] = True
+    for _ in range(num_agents - 1):
+        reached |= np.einsum("gi,gij->gj", reached, adjacency_matrices) > 0
+    return np.all(reached, axis=1)
+
+
+def enumerate_connected_graphs(num_agents):
+    """
+    Every connected communication graph of num_agents agents (728 for 5 agents).
+    :param num_agents: Number of agents
+    :return: boolean array with shape (num_graphs, num_edges), edge k as in get_edge_pairs
+    """
+    num_edges = num_agents * (num_agents - 1) // 2
+    assert num_edges <= MAX_ENUMERATED_EDGES, "ERROR: Too many graphs to enumerate, sample them instead."
+    edges = (np.arange(2 ** num_edges).reshape(-1, 1) >> np.arange(num_edges)) & 1 > 0
+    return edges[is_connected(to_adjacency_matrices(edges, num_agents))]
+
+
+def sample_connected_graphs(num_agents, num_graphs, edge_probability, rng):
+    """
+    Random connected graphs: a random spanning tree (every agent joins a random earlier agent of a random order)
+    plus every other edge with probability edge_probability. Repeated graphs are dropped.
+    :param num_agents: Number of agents
+    :param num_graphs: Number of sampled graphs
+    :param edge_probability: Probability of every edge that is not in the spanning tree
+    :param rng: numpy.random.Generator
+    :return: boolean array with shape (num_graphs, num_edges), edge k as in get_edge_pairs
+    """
+    rows, columns = get_edge_pairs(num_agents)
+    edge_index = np.full((num_agents, num_agents), -1)
+    edge_index[rows, columns] = np.arange(rows.shape[0])
+    edges = rng.random((num_graphs, rows.shape[0])) < edge_probability
+    for graph in range(num_graphs):
+        order = rng.permutation(num_agents)
+        parents = order[(rng.random(num_agents - 1) * np.arange(1, num_agents)).astype(int)]
+        children = order[1:]
+        edges[graph, edge_index[np.minimum(parents, children), np.maximum(parents, children)]] = True
+    return np.unique(edges, axis=0)
+
+
+def encode_graph(edges):
+    # Hexadecimal number whose bit k is edge k, as in get_edge_pairs
+    return hex(sum(1 << int(k) for k in np.nonzero(edges)[0]))
+
+
+def get_initial_positions(num_agents, seeds):
+    """
+    :param seeds: Seeds of the random initial poses, as in headless.py --seed. Seed -1 is the default horizontal line
+    :return: array with shape (len(seeds), 3, num_agents)
+    """
+    agents = Agents(num_agents)
+    initial_positions = np.zeros((len(seeds), 3, num_agents))
+    for index, seed in enumerate(seeds):
+        if seed < 0:
+            initial_positions[index, 0, :] = np.linspace(60, 300, num_agents)
+            initial_positions[index, 1, :] = 130
+        else:
+            np.random.seed(seed)
+            initial_positions[index] = agents.sample_poses(num_agents)
+    return initial_positions
+
+
+def init_worker(worker_setup):
+    # The graphs, poses and parameters are sent once per process; every case only sends its indexes
+    global setup
+    setup = worker_setup
+
+
+def run_case(case):
+    """
+    Runs one simulation of the sweep.
+    :param case: tuple (graph index, formation index, initial positions index)
+    :return: tuple (result, steps, error, collisions, seconds)
+        error: mean distance from the agents to their formation slots at the end [cm]
+        collisions: agent-agent contacts resolved during the run
+    """
+    graph, formation, positions = case
+    num_agents = setup["num_agents"]
+    engine = Engine(num_agents=num_agents, formation_name=setup["formations"][formation],
+                    adjacency_matrix=to_adjacency_matrices(setup["graphs"][graph:graph + 1], num_agents)[0],
+                    initial_positions=setup["initial_positions"][positions])
+    engine.assign_slots = setup["assign_slots"]
+    start = time.perf_counter()
+    result = engine.run_until(setup["max_steps"], tolerance=setup["tolerance"])
+    elapsed = time.perf_counter() - start
+    slots = np.hstack((np.zeros((2, 1)), engine.followers_deltas[:2, :])) + engine.leader_reference[:2].reshape(2, 1)
+    error = np.mean(np.hypot(*(engine.agents.agents_positions[:2, :] - slots)))
+    return result, engine.t, error, engine.agents.collision_count, elapsed
+
+
+def sweep(worker_setup, workers=None, chunksize=8):
+    """
+    Runs every combination of graph, formation and initial positions of worker_setup in a process pool.
+    :param worker_setup: dictionary with "num_agents", "graphs" (see enumerate_connected_graphs), "formations",
+                         "initial_positions" (see get_initial_positions), "max_steps", "tolerance" and "assign_slots"
+    :param workers: Number of processes (by default one per CPU)
+    :param chunksize: Number of cases sent to a process at once
+    :return: list with the (graph, formation, positions) indexes of every case and list with their run_case results
+    """
+    cases = [(graph, formation, positions) for graph in range(worker_setup["graphs"].shape[0])
+             for formation in range(len(worker_setup["formations"]))
+             for positions in range(worker_setup["initial_positions"].shape[0])]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_setup,)) as pool:
+        results = list(pool.map(run_case, cases, chunksize=chunksize))
+    return cases, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the formation simulation for every connected communication "
+                                                 "graph (or a random sample of them) in parallel, without the UI")
+    parser.add_argument("--num-agents", type=int, default=5, help="Number of agents")
+    parser.add_argument("--formations", nargs="+", default=["vertical_line", "triangle", "pentagon"],
+                        choices=FORMATIONS, help="Target formations")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[-1],
+                        help="Seeds of random initial positions, -1 for the default horizontal line")
+    parser.add_argument("--samples", type=int, default=None,
+                        help="Number of random connected graphs (by default all of them, if there are at most "
+                             f"2^{MAX_ENUMERATED_EDGES} graphs)")
+    parser.add_argument("--edge-probability", type=float, default=0.3,
+                        help="Probability of every extra edge of the sampled graphs that are not enumerated")
+    parser.add_argument("--sample-seed", type=int, default=0, help="Seed of the graph sampling")
+    parser.add_argument("--fixed-slots", action="store_true", help="Follower i always takes slot i of the formation")
+    parser.add_argument("--max-steps", type=int, default=350, help="Maximum number of simulation steps")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Convergence tolerance [cm]")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (by default one per CPU)")
+    parser.add_argument("--output", default="sweep.csv", help="Path of the results table")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.sample_seed)
+    num_edges = args.num_agents * (args.num_agents - 1) // 2
+    if num_edges <= MAX_ENUMERATED_EDGES:
+        graphs = enumerate_connected_graphs(args.num_agents)
+        if args.samples is not None and args.samples < graphs.shape[0]:
+            graphs = graphs[np.sort(rng.choice(graphs.shape[0], args.samples, replace=False))]
+    else:
+        assert args.samples is not None, "ERROR: Too many graphs to enumerate, use --samples."
+        graphs = sample_connected_graphs(args.num_agents, args.samples, args.edge_probability, rng)
+
+    worker_setup = {"num_agents": args.num_agents, "graphs": graphs, "formations": args.formations,
+                    "initial_positions": get_initial_positions(args.num_agents, args.seeds),
+                    "max_steps": args.max_steps, "tolerance": args.tolerance, "assign_slots": not args.fixed_slots}
+    print(f"{graphs.shape[0]} graphs x {len(args.formations)} formations x {len(args.seeds)} initial positions")
+    start = time.perf_counter()
+    cases, results = sweep(worker_setup, args.workers)
+    print(f"{len(cases)} runs in {time.perf_counter() - start:.1f} s")
+
+    with open(args.output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for (graph, formation, positions), (result, steps, error, collisions, elapsed) in zip(cases, results):
+            writer.writerow([encode_graph(graphs[graph]), int(np.sum(graphs[graph])), args.formations[formation],
+                             args.seeds[positions], result, steps, f"{error:.4f}", collisions, f"{elapsed:.4f}"])
+
+    # Summary per formation: the topologies that converged in the fewest steps
+    for formation_name in args.formations:
+        rows = [(steps, collisions, error, encode_graph(graphs[graph]))
+                for (graph, formation, _), (result, steps, error, collisions, _) in zip(cases, results)
+                if args.formations[formation] == formation_name and result == "converged"]
+        print(f"{formation_name}: {len(rows)} of {len(cases) // len(args.formations)} runs converged")
+        for steps, collisions, error, graph in sorted(rows)[:3]:
+            print(f"    graph {graph}: {steps} steps, {collisions} collisions, error {error:.3f} cm")
@@ -1,5 +1,4 @@
 import numpy as np
-from PyQt5 import QtGui
 
 def map_angles(angles):
     """
@@ -21,10 +20,21 @@ def demap_angles(angles):
     return (2 * np.pi + angles) * (angles < 0) + angles * (angles >= 0)
 
 
-def get_agent_colors():
+def get_agent_colors(num_colors=5):
+    """
+    Palette of the agents. The first five colors are fixed and the rest are spread over the hue circle with the golden
+    angle, so any number of colors stay distinguishable.
+    :param num_colors: Number of colors
+    :return: dictionary {color_id: QColor}
+    """
+    # Qt is only needed to draw, so it is imported here to keep the simulation usable without PyQt5
+    from PyQt5 import QtGui
+
     agents_colors = {0: QtGui.QColor(255, 186, 1), # Amarillo
                      1: QtGui.QColor(253, 86, 2),  # Naranja
                      2: QtGui.QColor(182, 75, 120),# Morado
                      3: QtGui.QColor(53, 214, 237),# Azul
                      4: QtGui.QColor(166, 214, 9)} # Verde
+    for color_id in range(len(agents_colors), num_colors):
+        agents_colors[color_id] = QtGui.QColor.fromHsvF((0.618034 * color_id) % 1, 0.75, 0.9)
     return agents_colors
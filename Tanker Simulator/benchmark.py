@@ -0,0 +1,142 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from tanker.tanker import Tanker
+from simulator import build_controller, reference_schedule
+
+
+def measure(function, repeat=5):
+    """
+    Mide el tiempo de ejecucion de una funcion.
+    :param function: Funcion sin argumentos
+    :param repeat: Numero de repeticiones
+    :return: menor tiempo de las repeticiones [s]
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_run_step(steps=20000):
+    """
+    Mide los pasos por segundo de Tanker.run_step con cada forma de integracion.
+    El tanker en lazo abierto es inestable, por lo que se simula en reposo (entrada nula).
+    :param steps: Numero de pasos por medicion
+    :return: diccionario {nombre: {"seconds": tiempo, "rate": pasos por segundo}}
+    """
+    results = dict()
+    configurations = {"rk4": dict(), "rk4_fast": {"fast_mode": True}, "dopri5": {"integrator": "dopri5"}}
+    for mode in ["ballast", "full"]:
+        for name, options in configurations.items():
+            def run():
+                tanker = Tanker(mode, [0, 0, 0], **options)
+                for _ in range(steps):
+                    tanker.run_step(0.0)
+            seconds = measure(run, repeat=3)
+            results[f"run_step[{mode},{name}]"] = {"seconds": seconds, "rate": steps / seconds}
+    return results
+
+
+def benchmark_predict(calls=20000, batch=100000):
+    """
+    Mide la latencia de predict con entradas escalares y de get_model_output con un lote de entradas.
+    :param calls: Numero de llamadas escalares por medicion
+    :param batch: Tamaño del lote
+    :return: diccionario {nombre: {"seconds": tiempo, "rate": muestras por segundo}}
+    """
+    results = dict()
+    rng = np.random.default_rng(0)
+    errors = rng.uniform(-np.pi / 2, np.pi / 2, batch)
+    d_errors = rng.uniform(-0.01, 0.01, batch)
+    for ctrl_name in ["nn", "rbf"]:
+        controller = build_controller(ctrl_name, 10)
+
+        def scalar():
+            for k in range(calls):
+                controller.predict(0.5, 1e-5 * k)
+        seconds = measure(scalar)
+        results[f"predict[{ctrl_name},scalar]"] = {"seconds": seconds, "rate": calls / seconds}
+
+        inputs = (errors,) if ctrl_name == "nn" else (errors, d_errors)
+        seconds = measure(lambda: controller.get_model_output(*inputs))
+        results[f"predict[{ctrl_name},batch]"] = {"seconds": seconds, "rate": batch / seconds}
+    return results
+
+
+def benchmark_in_out_map():
+    """
+    Mide el computo de la superficie de entrada y salida de cada controlador, sin graficarla.
+    :return: diccionario {nombre: {"seconds": tiempo}}
+    """
+    results = dict()
+    for ctrl_name in ["nn", "rbf"]:
+        controller = build_controller(ctrl_name, 10)
+        results[f"in_out_map[{ctrl_name}]"] = {"seconds": measure(controller.compute_in_out_map, repeat=3)}
+    return results
+
+
+def benchmark_closed_loop(steps_list=(4000, 100000, 1000000)):
+    """
+    Mide simulaciones completas en lazo cerrado con la red neuronal.
+    :param steps_list: Numero de pasos de cada simulacion
+    :return: diccionario {nombre: {"seconds": tiempo, "rate": pasos por segundo}}
+    """
+    results = dict()
+    for steps in steps_list:
+        def run():
+            Tanker("ballast", [0, 0, 0], fast_mode=True).simulate(build_controller("nn", 10), steps, 10,
+                                                                 reference_schedule)
+        seconds = measure(run, repeat=3 if steps <= 100000 else 1)
+        results[f"closed_loop[{steps}]"] = {"seconds": seconds, "rate": steps / seconds}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compara los resultados con una linea base.
+    :param results: Resultados actuales
+    :param baseline: Resultados de la linea base
+    :param threshold: Aumento relativo del tiempo permitido (0.2 = 20 %)
+    :return: lista de (nombre, tiempo base, tiempo actual) de las mediciones que empeoraron mas que el umbral
+    """
+    regressions = list()
+    for name, result in results.items():
+        if name in baseline and result["seconds"] > baseline[name]["seconds"] * (1 + threshold):
+            regressions.append((name, baseline[name]["seconds"], result["seconds"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del simulador del tanker")
+    parser.add_argument("--output", default="benchmark.json", help="Archivo JSON donde se guardan los resultados")
+    parser.add_argument("--baseline", help="Archivo JSON de una ejecucion anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Aumento relativo del tiempo permitido")
+    parser.add_argument("--quick", action="store_true", help="Omite la simulacion de 1M de pasos")
+    args = parser.parse_args()
+
+    benchmark_results = dict()
+    benchmark_results.update(benchmark_run_step())
+    benchmark_results.update(benchmark_predict())
+    benchmark_results.update(benchmark_in_out_map())
+    benchmark_results.update(benchmark_closed_loop((4000, 100000) if args.quick else (4000, 100000, 1000000)))
+    for benchmark_name, benchmark_result in benchmark_results.items():
+        print(f"{benchmark_name:<32} {benchmark_result['seconds']:>10.4f} s" +
+              (f" {benchmark_result['rate']:>14.1f} /s" if "rate" in benchmark_result else ""))
+
+    with open(args.output, "w") as output_file:
+        json.dump({"python": platform.python_version(), "numpy": np.__version__,
+                   "results": benchmark_results}, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)["results"]
+        slower = compare(benchmark_results, baseline_results, args.threshold)
+        for benchmark_name, before, after in slower:
+            print(f"REGRESSION {benchmark_name}: {before:.4f} s -> {after:.4f} s")
+        sys.exit(1 if slower else 0)
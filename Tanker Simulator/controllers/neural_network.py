@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 class NeuralNetwork:
@@ -21,35 +20,86 @@ class NeuralNetwork:
         self.b13 = 0
         self.b23 = 80 * np.pi / 180
 
-    def predict(self, reference, angle):
+    def get_model_output(self, error):
         """
-        Metodo para obtener la salida del controlador.
+        Metodo para obtener la salida de la red a partir del error de seguimiento.
         Este metodo computa la salida como se explica en el libro de Kevin pagina 123
-        :param reference: Referencia del controlador (\Psi_r en el libro)
-        :param angle: Angulo actual del sistema (\Psi en el libro)
+        :param error: Error de seguimiento, escalar o arreglo
         :return: Salida del controlador.
         """
-        error = reference - angle
         x_bar_1 = self.b12 + self.w112 * error
         x_bar_2 = self.b22 + self.w122 * error
         x11 = 1 / (1 + np.exp(-x_bar_1))
         x21 = 1 / (1 + np.exp(-x_bar_2))
         return self.b13 + self.w113 * x11 + self.b23 + self.w223 * x21
 
-    def plot_in_out_map(self):
+    def compute_inputs(self, reference, angle):
+        """
+        Metodo para obtener las entradas de la red a partir de la referencia y el estado del sistema.
+        :param reference: Referencia del controlador (\Psi_r en el libro)
+        :param angle: Angulo actual del sistema (\Psi en el libro)
+        :return: tupla (error,)
+        """
+        return (reference - angle,)
+
+    def get_input_ranges(self):
+        """
+        Metodo para obtener el rango de interes de cada entrada de la red.
+        Fuera de este rango las neuronas de la capa oculta estan saturadas.
+        :return: lista [(minimo, maximo)] con el rango del error
+        """
+        return [(-np.pi, np.pi)]
+
+    def get_parameters(self):
+        """
+        Metodo para obtener los parametros del modelo.
+        :return: diccionario {nombre del parametro: valor}
+        """
+        return {"w112": self.w112, "w122": self.w122, "b12": self.b12, "b22": self.b22,
+                "w113": self.w113, "w223": self.w223, "b13": self.b13, "b23": self.b23}
+
+    def predict(self, reference, angle):
+        """
+        Metodo para obtener la salida del controlador.
+        Este metodo computa la salida como se explica en el libro de Kevin pagina 123
+        :param reference: Referencia del controlador (\Psi_r en el libro)
+        :param angle: Angulo actual del sistema (\Psi en el libro)
+        :return: Salida del controlador.
+        """
+        return self.get_model_output(*self.compute_inputs(reference, angle))
+
+    def compute_in_out_map(self, resolution=None):
+        """
+        Este metodo computa el mapeo entre entrada y salida del controlador sin graficarlo.
+        :param resolution: Numero opcional de puntos por eje. Por defecto la malla tiene un punto cada 0.2 grados
+        :return: tupla (x, y, output) con la referencia, el angulo y la salida del controlador en grados
+        """
+        axis = np.arange(-100, 100, 0.2) if resolution is None else np.linspace(-100, 100, resolution)
+        x, y = np.meshgrid(axis, axis)
+        output = self.predict(x.flatten()*np.pi/180, y.flatten()*np.pi/180).reshape(x.shape)
+        output *= (180/np.pi)
+        return x, y, output
+
+    def plot_in_out_map(self, output=None, dpi=100):
         """
         Este metodo grafica el mapeo entre entrada y salida del controlador
         Página 126 del libro de kevin.
+        Si se indica output la figura se guarda en ese archivo sin mostrarla, y la malla se reduce a la
+        resolucion que se alcanza a ver en la imagen (ver utils.get_grid_resolution).
+        :param output: Ruta opcional del archivo donde se guarda la figura
+        :param dpi: Resolucion del archivo [puntos por pulgada]
         :return:
         """
-        x, y = np.meshgrid(np.arange(-100, 100, 0.2), np.arange(-100, 100, 0.2))
-        output = self.predict(x.flatten()*np.pi/180, y.flatten()*np.pi/180).reshape(x.shape)
-        output *= (180/np.pi)
+        from utils import create_figure, show_figure, get_grid_resolution
+
+        figsize = (6, 6)
+        resolution = None if output is None else get_grid_resolution(figsize, dpi)
+        x, y, in_out_map = self.compute_in_out_map(resolution)
 
-        fig = plt.figure(figsize=(6, 6))
+        fig = create_figure(figsize, offscreen=output is not None)
         ax = fig.add_subplot(111, projection='3d')
-        ax.plot_wireframe(x, y, output, color="gray", linewidth=1)
-        plt.xlabel(f"Reference input $\Psi_r$ deg.")
-        plt.ylabel(f"Heading angle $\Psi$ deg.")
+        ax.plot_wireframe(x, y, in_out_map, color="gray", linewidth=1)
+        ax.set_xlabel(f"Reference input $\Psi_r$ deg.")
+        ax.set_ylabel(f"Heading angle $\Psi$ deg.")
         ax.set_zlabel(r'Controller output $\delta$ deg.')
-        plt.show()
+        show_figure(fig, output, dpi)
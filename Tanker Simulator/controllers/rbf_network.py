@@ -1,51 +1,157 @@
-import itertools
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 class RBFNetwork:
     """
     Esta clase implementa un controlador tipo red Neuronal RBF
     """
-    def __init__(self, sampling_interval):
+    def __init__(self, sampling_interval, n_partitions=11):
         """
         Constructor de la clase
         Inicializa los parametros de la red neuronal como se describe en
         la pagina 134 del libro de Kevin
         :param sampling_interval:
+        :param n_partitions: Numero de particiones por entrada. La red tiene n_partitions**2 centros.
         """
         self.sampling_interval = sampling_interval
-        n_partitions = 11
+        self.n_partitions = n_partitions
         self.sigma_e = 0.7 * (np.pi / n_partitions)
         self.sigma_c = 0.7 * (0.02 / n_partitions)
         self.last_error = 0
-        # Computo de los centros
-        self.centers = list(itertools.product(np.linspace(-np.pi / 2, np.pi / 2, n_partitions),
-                                         np.linspace(-0.01, 0.01, n_partitions)))
-        temp = np.linspace(-(n_partitions - 1) / 2, (n_partitions - 1) / 2, n_partitions)
-        self.b = np.zeros((n_partitions, n_partitions))
+        # Computo de los centros. La red usa todas las combinaciones (e_c, c_c), por lo que basta con
+        # guardar los centros de cada entrada; self.centers contiene los n_partitions**2 pares.
+        self.centers_e = np.linspace(-np.pi / 2, np.pi / 2, n_partitions)
+        self.centers_c = np.linspace(-0.01, 0.01, n_partitions)
+        self.centers = np.stack(np.meshgrid(self.centers_e, self.centers_c, indexing="ij"), axis=-1).reshape(-1, 2)
         # Computo de los parametros b. Pagina 136
-        for i in range(n_partitions):
-            for j in range(n_partitions):
-                self.b[i][j] = -((1 / 10) * (200 * (np.pi / 180)) * temp[i] +
-                                 (1 / 10) * (200 * (np.pi / 180)) * temp[j])
-                self.b[i][j] = np.maximum(-80 * (np.pi / 180), np.minimum(80 * (np.pi / 180), self.b[i][j]))
-        self.b = self.b.T.flatten().reshape(-1, 1)
+        temp = np.linspace(-(n_partitions - 1) / 2, (n_partitions - 1) / 2, n_partitions)
+        gain = (1 / 10) * (200 * (np.pi / 180))
+        b = -(gain * temp.reshape(-1, 1) + gain * temp)
+        b = np.clip(b, -80 * (np.pi / 180), 80 * (np.pi / 180))
+        # b[k] es el peso del centro self.centers[k]
+        self.b = b.T.flatten()
+        # Sumas acumuladas de los minimos cuadrados (A^T A y A^T y) usadas por partial_fit
+        self.gram = np.zeros((n_partitions ** 2, n_partitions ** 2))
+        self.moment = np.zeros(n_partitions ** 2)
 
     def get_model_output(self, error, d_error):
         """
         Metodo para obtener la salida del controlador.
-        Este metodo computa la salida como se explica en el libro de Kevin pagina 123
-        :param error:
-        :param d_error:
-        :return:
+        Este metodo computa la salida como se explica en el libro de Kevin pagina 123.
+        La activacion de cada centro es exp(-(e - e_c)^2/sigma_e^2) * exp(-(de - c_c)^2/sigma_c^2), por lo que
+        solo se evaluan 2*n_partitions exponenciales y la suma sobre los centros se hace con un producto matricial.
+        Acepta escalares o arreglos de errores (se evaluan todos a la vez). Si self.b tiene forma (..., n_centers),
+        cada conjunto de pesos se evalua con el error correspondiente.
+        :param error: Error de seguimiento, escalar o arreglo
+        :param d_error: Cambio en el error de seguimiento, escalar o arreglo
+        :return: Salida del controlador, float para entradas escalares o arreglo con la forma de las entradas
+        """
+        g_e, g_c = self.get_activations(error, d_error, separable=True)
+        if self.b.ndim == 1:
+            output = np.sum(np.dot(g_e, self.b.reshape(self.n_partitions, self.n_partitions)) * g_c, axis=-1)
+        else:
+            weights = self.b.reshape(self.b.shape[:-1] + (self.n_partitions, self.n_partitions))
+            output = np.sum(np.matmul(g_e[..., None, :], weights)[..., 0, :] * g_c, axis=-1)
+        return float(output) if output.ndim == 0 else output
+
+    def get_activations(self, error, d_error, separable=False):
+        """
+        Metodo para obtener la activacion de cada centro, es decir la fila de la matriz de diseño de los
+        minimos cuadrados: get_model_output(error, d_error) = get_activations(error, d_error) @ self.b
+        :param error: Error de seguimiento, escalar o arreglo
+        :param d_error: Cambio en el error de seguimiento, escalar o arreglo
+        :param separable: Si es True retorna los dos factores de la activacion sin multiplicarlos
+        :return: arreglo de forma (..., n_partitions**2) con la activacion del centro self.centers[k] en la posicion k,
+            o si separable es True la tupla (g_e, g_c) de arreglos de forma (..., n_partitions) con la activacion de
+            cada centro de e y de c, cuyo producto externo es la activacion de los centros
+        """
+        g_e = np.exp(-np.square(np.subtract.outer(error, self.centers_e)) / self.sigma_e ** 2)
+        g_c = np.exp(-np.square(np.subtract.outer(d_error, self.centers_c)) / self.sigma_c ** 2)
+        if separable:
+            return g_e, g_c
+        return (g_e[..., :, None] * g_c[..., None, :]).reshape(g_e.shape[:-1] + (-1,))
+
+    def fit(self, errors, d_errors, targets, regularization=1e-6, chunk_size=20000):
+        """
+        Metodo para ajustar los pesos self.b a datos registrados con minimos cuadrados regularizados.
+        Descarta lo acumulado por ajustes anteriores y llama a partial_fit.
+        :param errors: Errores de seguimiento, arreglo de forma (N,) (puede ser un np.memmap)
+        :param d_errors: Cambios en el error de seguimiento, arreglo de forma (N,)
+        :param targets: Salida deseada del controlador para cada muestra [rad], arreglo de forma (N,)
+        :param regularization: Peso de la regularizacion de Tikhonov (ridge) sobre self.b
+        :param chunk_size: Numero de muestras con las que se construye cada bloque de la matriz de diseño
+        :return: self.b
+        """
+        self.gram[...] = 0
+        self.moment[...] = 0
+        return self.partial_fit(errors, d_errors, targets, regularization=regularization, chunk_size=chunk_size)
+
+    def partial_fit(self, errors, d_errors, targets, regularization=1e-6, forgetting_factor=1.0, chunk_size=20000):
+        """
+        Metodo para actualizar los pesos self.b con un nuevo bloque de datos (minimos cuadrados recursivos).
+        La matriz de diseño se construye por bloques de chunk_size muestras y solo se acumulan A^T A y A^T y,
+        de tamaño n_partitions**2, por lo que la memoria no depende del numero de muestras.
+        Con forgetting_factor < 1 el peso de cada muestra decae en ese factor por cada muestra posterior,
+        de modo que los pesos siguen a datos recientes cuando se reajusta en linea.
+        :param errors: Errores de seguimiento, arreglo de forma (N,) (puede ser un np.memmap)
+        :param d_errors: Cambios en el error de seguimiento, arreglo de forma (N,)
+        :param targets: Salida deseada del controlador para cada muestra [rad], arreglo de forma (N,)
+        :param regularization: Peso de la regularizacion de Tikhonov (ridge) sobre self.b
+        :param forgetting_factor: Factor de olvido por muestra, entre 0 (exclusivo) y 1
+        :param chunk_size: Numero de muestras con las que se construye cada bloque de la matriz de diseño
+        :return: self.b
+        """
+        assert 0 < forgetting_factor <= 1, "The forgetting factor should be in (0, 1]"
+        assert self.b.ndim == 1, "Only a single set of weights can be fitted"
+        n_samples = len(targets)
+        assert len(errors) == n_samples and len(d_errors) == n_samples, "All inputs should have the same length"
+        for start in range(0, n_samples, chunk_size):
+            end = min(start + chunk_size, n_samples)
+            activations = self.get_activations(np.asarray(errors[start:end], dtype=float),
+                                               np.asarray(d_errors[start:end], dtype=float))
+            target = np.asarray(targets[start:end], dtype=float)
+            if forgetting_factor < 1:
+                self.gram *= forgetting_factor ** (end - start)
+                self.moment *= forgetting_factor ** (end - start)
+                weights = forgetting_factor ** np.arange(end - start - 1, -1, -1, dtype=float)
+                self.gram += activations.T @ (activations * weights[:, None])
+                self.moment += activations.T @ (target * weights)
+            else:
+                self.gram += activations.T @ activations
+                self.moment += activations.T @ target
+        self.b = np.linalg.solve(self.gram + regularization * np.eye(self.gram.shape[0]), self.moment)
+        return self.b
+
+    def compute_inputs(self, reference, angle):
+        """
+        Metodo para obtener las entradas de la red a partir de la referencia y el estado del sistema.
+        Actualiza el ultimo error usado para computar el cambio en el error.
+        :param reference: Referencia del controlador (\Psi_r en el libro)
+        :param angle: Angulo actual del sistema (\Psi en el libro)
+        :return: tupla (error, d_error)
+        """
+        error = reference - angle
+        d_error = (error - self.last_error)/self.sampling_interval
+        self.last_error = error
+        return error, d_error
+
+    def get_input_ranges(self):
+        """
+        Metodo para obtener el rango de interes de cada entrada de la red.
+        A mas de tres desviaciones de los centros extremos la salida de la red es practicamente nula.
+        :return: lista [(minimo, maximo)] con el rango del error y del cambio en el error
+        """
+        return [(self.centers_e[0] - 3 * self.sigma_e, self.centers_e[-1] + 3 * self.sigma_e),
+                (self.centers_c[0] - 3 * self.sigma_c, self.centers_c[-1] + 3 * self.sigma_c)]
+
+    def get_parameters(self):
+        """
+        Metodo para obtener los parametros del modelo.
+        :return: diccionario {nombre del parametro: valor}
         """
-        activations = list()
-        for (e_c, c_c) in self.centers:
-            activations.append(np.exp(-(((error - e_c) ** 2) / self.sigma_e ** 2) -
-                                      (((d_error - c_c) ** 2) / self.sigma_c ** 2)))
-        activations = np.array(activations).reshape(-1, 1)
-        return float(self.b.T.dot(activations))
+        return {"sampling_interval": self.sampling_interval, "n_partitions": self.n_partitions,
+                "sigma_e": self.sigma_e, "sigma_c": self.sigma_c,
+                "centers_e": self.centers_e, "centers_c": self.centers_c, "b": self.b}
 
     def predict(self, reference, angle):
         """
@@ -55,27 +161,43 @@ class RBFNetwork:
         :param angle: Angulo actual del sistema (\Psi en el libro)
         :return: Salida del controlador
         """
-        error = reference - angle
-        d_error = (error - self.last_error)/self.sampling_interval
-        self.last_error = error
+        return self.get_model_output(*self.compute_inputs(reference, angle))
 
-        return self.get_model_output(error, d_error)
+    def compute_in_out_map(self, resolution=None):
+        """
+        Este metodo computa el mapeo entre entrada y salida del controlador sin graficarlo.
+        :param resolution: Numero opcional de puntos por eje. Por defecto la malla tiene 50 puntos por eje
+        :return: tupla (e, d_e, output) con el error, el cambio en el error y la salida del controlador en radianes
+        """
+        if resolution is None:
+            e, d_e = np.meshgrid(np.arange(-95*(np.pi/180), 95*(np.pi/180), 190*(np.pi/180)/50),
+                                 np.arange(-0.00999, 0.00999, 0.02/50))
+        else:
+            e, d_e = np.meshgrid(np.linspace(-95*(np.pi/180), 95*(np.pi/180), resolution),
+                                 np.linspace(-0.00999, 0.00999, resolution))
+        output = self.get_model_output(e, d_e)
+        return e, d_e, output
 
-    def plot_in_out_map(self):
+    def plot_in_out_map(self, output=None, dpi=100):
         """
         Este metodo grafica el mapeo entre entrada y salida del controlador
         Página 137 del libro de kevin.
+        Si se indica output la figura se guarda en ese archivo sin mostrarla, con la resolucion de la malla
+        ajustada al tamaño de la imagen (ver utils.get_grid_resolution).
+        :param output: Ruta opcional del archivo donde se guarda la figura
+        :param dpi: Resolucion del archivo [puntos por pulgada]
         :return:
         """
-        e, d_e = np.meshgrid(np.arange(-95*(np.pi/180), 95*(np.pi/180), 190*(np.pi/180)/50),
-                             np.arange(-0.00999, 0.00999, 0.02/50))
-        output = np.array([self.get_model_output(error, d_error) for (error, d_error) in zip(e.flatten(), d_e.flatten())])
-        output = output.reshape(e.shape)
+        from utils import create_figure, show_figure, get_grid_resolution
+
+        figsize = (6, 6)
+        resolution = None if output is None else get_grid_resolution(figsize, dpi)
+        e, d_e, in_out_map = self.compute_in_out_map(resolution)
 
-        fig = plt.figure(figsize=(6, 6))
+        fig = create_figure(figsize, offscreen=output is not None)
         ax = fig.add_subplot(111, projection='3d')
-        ax.plot_wireframe(e*(180/np.pi), d_e*(180/np.pi), output*(180 / np.pi), color="gray", linewidth=1)
-        plt.xlabel(f"Heading error [deg]")
-        plt.ylabel(f"Change in heading error [deg]")
+        ax.plot_wireframe(e*(180/np.pi), d_e*(180/np.pi), in_out_map*(180 / np.pi), color="gray", linewidth=1)
+        ax.set_xlabel(f"Heading error [deg]")
+        ax.set_ylabel(f"Change in heading error [deg]")
         ax.set_zlabel(r'Controller output $\delta$ [deg]')
-        plt.show()
\ No newline at end of file
+        show_figure(fig, output, dpi)
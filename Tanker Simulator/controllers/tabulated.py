@@ -0,0 +1,143 @@
+import os
+import hashlib
+import itertools
+import numpy as np
+
+
+class TabulatedController:
+    """
+    Esta clase envuelve un controlador (NeuralNetwork o RBFNetwork) y reemplaza la evaluacion de
+    su modelo por la interpolacion lineal (o bilineal) de una tabla precomputada sobre una malla uniforme.
+    Las entradas fuera de la malla se limitan a sus bordes.
+    """
+    def __init__(self, controller, grid_size=None, input_ranges=None, cache_dir=None):
+        """
+        Constructor de la clase
+        :param controller: Controlador con los metodos get_model_output, compute_inputs,
+                           get_input_ranges y get_parameters
+        :param grid_size: Numero de puntos de la malla por entrada. Por defecto 2001 para
+                          controladores de una entrada y 401 para controladores de dos entradas.
+        :param input_ranges: Lista [(minimo, maximo)] por entrada. Por defecto controller.get_input_ranges()
+        :param cache_dir: Carpeta opcional donde se guardan las tablas. Si ya existe una tabla para los mismos
+                          parametros del controlador y la misma malla, se carga en lugar de recomputarla.
+        """
+        self.controller = controller
+        self.input_ranges = [(float(low), float(high)) for (low, high) in
+                             (input_ranges or controller.get_input_ranges())]
+        self.n_inputs = len(self.input_ranges)
+        self.grid_size = grid_size or (2001 if self.n_inputs == 1 else 401)
+        self.axes = [np.linspace(low, high, self.grid_size) for (low, high) in self.input_ranges]
+        self.spacing = [axis[1] - axis[0] for axis in self.axes]
+        # Desplazamientos de las esquinas de una celda en la tabla aplanada
+        self._strides = [self.grid_size ** (self.n_inputs - k - 1) for k in range(self.n_inputs)]
+        self._corners = [(sum(bit * stride for bit, stride in zip(bits, self._strides)), bits)
+                         for bits in itertools.product((0, 1), repeat=self.n_inputs)]
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"{type(controller).__name__}_{self.get_cache_key()}.npz")
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                self.table = cached["table"]
+                self.error_bound = float(cached["error_bound"])
+        else:
+            self.table = controller.get_model_output(*np.meshgrid(*self.axes, indexing="ij"))
+            self.error_bound = self.compute_error_bound()
+            if cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez(cache_path, table=self.table, error_bound=self.error_bound)
+
+        # Tabla como lista y malla como numeros de punto flotante para interpolar entradas escalares
+        # sin crear arreglos
+        self._flat_table = self.table.flatten().tolist()
+        self._scalar_axes = [(float(axis[0]), float(1 / step), stride)
+                             for axis, step, stride in zip(self.axes, self.spacing, self._strides)]
+
+    def get_cache_key(self):
+        """
+        Metodo para obtener la llave de la tabla a partir de los parametros del controlador y de la malla.
+        :return: cadena hexadecimal
+        """
+        digest = hashlib.sha1(type(self.controller).__name__.encode())
+        parameters = self.controller.get_parameters()
+        for name in sorted(parameters):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(parameters[name], dtype=float).tobytes())
+        digest.update(np.array(self.input_ranges + [(self.grid_size, 0)], dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def compute_error_bound(self):
+        """
+        Metodo para estimar el error de la interpolacion respecto al controlador exacto.
+        Se evalua el maximo error absoluto en los puntos medios de las celdas de la malla, que es donde
+        la interpolacion lineal se aleja mas de una funcion suave.
+        :return: maximo error absoluto encontrado
+        """
+        midpoints = [axis[:-1] + 0.5 * step for axis, step in zip(self.axes, self.spacing)]
+        grid = np.meshgrid(*midpoints, indexing="ij")
+        return float(np.max(np.abs(self.get_model_output(*grid) - self.controller.get_model_output(*grid))))
+
+    def get_model_output(self, *inputs):
+        """
+        Metodo para obtener la salida del controlador interpolando la tabla.
+        :param inputs: Entradas del modelo (las mismas de controller.get_model_output), escalares o arreglos
+        :return: Salida interpolada, float para entradas escalares o arreglo con la forma de las entradas
+        """
+        if all(isinstance(value, (float, int)) for value in inputs):
+            return self.interpolate_scalar(inputs)
+
+        indexes, fractions = list(), list()
+        for value, axis, step in zip(inputs, self.axes, self.spacing):
+            position = np.clip((np.asarray(value, dtype=float) - axis[0]) / step, 0, self.grid_size - 1)
+            index = np.minimum(position.astype(int), self.grid_size - 2)
+            indexes.append(index)
+            fractions.append(position - index)
+        output = 0
+        for _, bits in self._corners:
+            weight = 1
+            for fraction, bit in zip(fractions, bits):
+                weight = weight * (fraction if bit else 1 - fraction)
+            output = output + weight * self.table[tuple(index + bit for index, bit in zip(indexes, bits))]
+        return output
+
+    def interpolate_scalar(self, inputs):
+        """
+        Metodo para interpolar la tabla en un unico punto usando solo operaciones escalares.
+        :param inputs: Entradas escalares del modelo
+        :return: Salida interpolada
+        """
+        base, fractions = 0, list()
+        last = self.grid_size - 1
+        for value, (low, inverse_step, stride) in zip(inputs, self._scalar_axes):
+            position = (value - low) * inverse_step
+            if position <= 0:
+                index, fraction = 0, 0.0
+            elif position >= last:
+                index, fraction = last - 1, 1.0
+            else:
+                index = int(position)
+                fraction = position - index
+            fractions.append(fraction)
+            base += index * stride
+        table = self._flat_table
+        if self.n_inputs == 1:
+            fraction = fractions[0]
+            return (1 - fraction) * table[base] + fraction * table[base + 1]
+        output = 0.0
+        for offset, bits in self._corners:
+            weight = 1.0
+            for fraction, bit in zip(fractions, bits):
+                weight *= fraction if bit else 1 - fraction
+            output += weight * table[base + offset]
+        return output
+
+    def predict(self, reference, angle):
+        """
+        Metodo para obtener la salida del controlador.
+        Las entradas se computan con el controlador envuelto (que conserva su estado, por ejemplo
+        el ultimo error de la red RBF) y la salida se obtiene de la tabla.
+        :param reference: Referencia del controlador (\\Psi_r en el libro)
+        :param angle: Angulo actual del sistema (\\Psi en el libro)
+        :return: Salida del controlador
+        """
+        return self.get_model_output(*self.controller.compute_inputs(reference, angle))
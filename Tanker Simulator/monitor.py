@@ -0,0 +1,174 @@
+import time
+import numpy as np
+from utils import decimate_envelope
+
+
+class RingBuffer:
+    """
+    Esta clase guarda las ultimas filas de una serie de tiempo en un arreglo circular de tamaño fijo.
+    Agregar filas sobrescribe las mas antiguas, por lo que la memoria usada no depende de cuantas filas se agreguen.
+    """
+    def __init__(self, capacity, n_columns):
+        """
+        Constructor de la clase
+        :param capacity: Numero maximo de filas
+        :param n_columns: Numero de columnas de cada fila
+        """
+        self.capacity = capacity
+        self.data = np.zeros((capacity, n_columns))
+        self.ordered = np.zeros((capacity, n_columns))
+        self.position = 0
+        self.size = 0
+
+    def extend(self, rows):
+        """
+        Metodo para agregar filas al final del buffer.
+        :param rows: Arreglo de forma (n, n_columns)
+        :return:
+        """
+        rows = rows[-self.capacity:]
+        n_rows = rows.shape[0]
+        first = min(n_rows, self.capacity - self.position)
+        self.data[self.position:self.position + first] = rows[:first]
+        self.data[:n_rows - first] = rows[first:]
+        self.position = (self.position + n_rows) % self.capacity
+        self.size = min(self.size + n_rows, self.capacity)
+
+    def get(self):
+        """
+        Metodo para obtener las filas guardadas de la mas antigua a la mas reciente.
+        Las filas se copian a un arreglo reservado en el constructor, por lo que el resultado es valido
+        hasta la siguiente llamada.
+        :return: arreglo de forma (size, n_columns)
+        """
+        start = (self.position - self.size) % self.capacity
+        first = min(self.size, self.capacity - start)
+        self.ordered[:first] = self.data[start:start + first]
+        self.ordered[first:self.size] = self.data[:self.size - first]
+        return self.ordered[:self.size]
+
+
+class LiveMonitor:
+    """
+    Esta clase grafica en vivo los ultimos segundos del angulo del barco, la referencia y la señal de control
+    mientras avanza la simulacion. Las filas de la trayectoria se guardan en un RingBuffer y la figura se
+    redibuja con blitting (solo se dibujan las lineas sobre un fondo guardado) a lo sumo fps veces por segundo,
+    por lo que update es casi gratis entre cuadros.
+    """
+    def __init__(self, window_seconds=600, integration_step=1, fps=10, figsize=(6.4, 4.8), dpi=100):
+        """
+        Constructor de la clase
+        :param window_seconds: Duracion de la ventana graficada [s]
+        :param integration_step: Paso de integracion del tanker [s]
+        :param fps: Maximo numero de cuadros por segundo
+        :param figsize: Tamaño de la figura [pulgadas]
+        :param dpi: Resolucion de la figura [puntos por pulgada]
+        """
+        import matplotlib.pyplot as plt
+
+        capacity = max(2, int(window_seconds / integration_step))
+        self.buffer = RingBuffer(capacity, 5)
+        self.integration_step = integration_step
+        self.frame_interval = 1 / fps
+        self.max_points = 2 * int(figsize[0] * dpi)
+        # Tiempo de cada fila del buffer relativo a la ultima fila [s]
+        self.times = (np.arange(capacity) - capacity + 1) * integration_step
+        self.steps = 0
+        self.last_draw = -np.inf
+        self.background = None
+
+        plt.ion()
+        self.fig, axs = plt.subplots(2, 1, figsize=figsize, dpi=dpi)
+        self.axs = axs
+        self.lines = [axs[0].plot([], [], color="black", linewidth=1, animated=True, label="Ship heading")[0],
+                      axs[0].plot([], [], color="black", linewidth=1, linestyle="--", animated=True,
+                                  label="Desired ship heading")[0],
+                      axs[1].plot([], [], color="black", linewidth=1, animated=True)[0]]
+        self.columns = [0, 3, 4]
+        self.clock = axs[0].text(0.02, 0.9, "", transform=axs[0].transAxes, animated=True)
+        axs[0].set_title('Ship heading vs Desired ship heading')
+        axs[0].legend(loc="upper right")
+        axs[0].set(ylabel='[deg]')
+        axs[1].set_title('Rudder Angle')
+        axs[1].set(xlabel='time [s]', ylabel=f'$\\delta$ [deg]')
+        for ax in axs:
+            ax.set_xlim(self.times[0], 0)
+            ax.set_ylim(-90, 90)
+            ax.grid(True)
+        self.fig.tight_layout()
+        # Cada vez que se redibuja toda la figura (por ejemplo al cambiar su tamaño) se guarda el nuevo fondo
+        self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+        plt.show(block=False)
+        self.fig.canvas.draw()
+
+    def on_draw(self, event):
+        """
+        Metodo que guarda el fondo de la figura (todo menos las lineas) despues de cada dibujo completo.
+        :param event: Evento de matplotlib
+        :return:
+        """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def update(self, block):
+        """
+        Metodo para agregar un bloque de la trayectoria. La figura se redibuja solo si paso el
+        intervalo entre cuadros desde el ultimo dibujo.
+        :param block: Arreglo de forma (n, 5) con las columnas [x1, x2, x3, referencia, señal de control] en radianes
+        :return: True si se redibujo la figura
+        """
+        self.buffer.extend(block)
+        self.steps += block.shape[0]
+        now = time.perf_counter()
+        if now - self.last_draw < self.frame_interval:
+            return False
+        self.last_draw = now
+        self.draw()
+        return True
+
+    def draw(self):
+        """
+        Metodo para redibujar las lineas con el contenido del buffer.
+        Si alguna serie sale de los limites del eje, los limites se amplian y se redibuja toda la figura.
+        :return:
+        """
+        if self.buffer.size == 0:
+            return
+        rows = self.buffer.get()
+        offset = self.buffer.capacity - rows.shape[0]
+        series = list()
+        for column in self.columns:
+            indexes, values = decimate_envelope(rows[:, column], self.max_points)
+            series.append((self.times[offset + indexes], values * (180 / np.pi)))
+
+        rescaled = False
+        for ax, lines in zip(self.axs, (series[:2], series[2:])):
+            low = min(np.nanmin(values) for _, values in lines if values.shape[0] > 0)
+            high = max(np.nanmax(values) for _, values in lines if values.shape[0] > 0)
+            bottom, top = ax.get_ylim()
+            if np.isfinite(low) and np.isfinite(high) and (low < bottom or high > top):
+                margin = 0.1 * (max(high, top) - min(low, bottom))
+                ax.set_ylim(min(low, bottom) - margin, max(high, top) + margin)
+                rescaled = True
+        if rescaled:
+            self.fig.canvas.draw()
+
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for line, (times, values) in zip(self.lines, series):
+            line.set_data(times, values)
+            self.fig.draw_artist(line)
+        self.clock.set_text(f"t = {self.steps * self.integration_step:.0f} s")
+        self.fig.draw_artist(self.clock)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def close(self):
+        """
+        Metodo para dibujar el ultimo cuadro y cerrar la figura.
+        :return:
+        """
+        import matplotlib.pyplot as plt
+
+        self.draw()
+        plt.ioff()
+        plt.close(self.fig)
@@ -0,0 +1,96 @@
+import time
+import numpy as np
+
+
+class Profiler:
+    """
+    Esta clase acumula el tiempo de cada fase de la simulacion en lazo cerrado (evaluacion del controlador,
+    integracion de la planta y registro de la trayectoria) y contadores como el numero de evaluaciones de
+    las ecuaciones del tanker. Tanker.simulate solo mide las fases si recibe un Profiler; sin el usa el reloj
+    tanker.no_timer, que no consulta el tiempo.
+    """
+    PHASES = ["controller", "plant", "recording"]
+
+    def __init__(self, timer=time.perf_counter, trace=False):
+        """
+        Constructor de la clase
+        :param timer: Funcion sin argumentos que retorna el tiempo actual en segundos (por ejemplo
+                      time.perf_counter o time.process_time)
+        :param trace: Si es True se guarda ademas el tiempo de cada fase en cada paso (ver get_trace)
+        """
+        self.timer = timer
+        self.trace = trace
+        self.times = {phase: 0.0 for phase in self.PHASES}
+        self.calls = {phase: 0 for phase in self.PHASES}
+        self.counters = dict()
+        self.trace_blocks = list()
+
+    def add(self, phase, seconds, calls=1):
+        """
+        Metodo para sumar el tiempo medido en una fase.
+        :param phase: Nombre de la fase. Se aceptan fases distintas a PHASES (por ejemplo "output")
+        :param seconds: Tiempo medido [s]
+        :param calls: Numero de veces que se ejecuto la fase durante ese tiempo
+        :return:
+        """
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def count(self, name, value=1):
+        """
+        Metodo para incrementar un contador.
+        :param name: Nombre del contador (por ejemplo "rhs_evaluations")
+        :param value: Incremento
+        :return:
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_trace(self, block):
+        """
+        Metodo para agregar tiempos por paso a la traza. Solo se utiliza si trace es True.
+        :param block: Arreglo de forma (n, 1 + len(PHASES)) con las columnas [paso, tiempo de cada fase]
+        :return:
+        """
+        self.trace_blocks.append(block)
+
+    def get_trace(self):
+        """
+        Metodo para obtener la traza por paso.
+        Con el integrador "dopri5" cada fila corresponde a un intervalo de muestreo en lugar de a un paso.
+        :return: arreglo de forma (n, 1 + len(PHASES)) con las columnas [paso, controlador, planta, registro] [s]
+        """
+        if not self.trace_blocks:
+            return np.empty((0, 1 + len(self.PHASES)))
+        return np.concatenate(self.trace_blocks)
+
+    def save_trace(self, path):
+        """
+        Metodo para guardar la traza por paso en un archivo .npy, bloque por bloque.
+        :param path: Ruta del archivo .npy
+        :return:
+        """
+        n_rows = sum(block.shape[0] for block in self.trace_blocks)
+        trace = np.lib.format.open_memmap(path, mode="w+", dtype=float, shape=(n_rows, 1 + len(self.PHASES)))
+        start = 0
+        for block in self.trace_blocks:
+            trace[start:start + block.shape[0]] = block
+            start += block.shape[0]
+        trace.flush()
+        del trace
+
+    def summary(self):
+        """
+        Metodo para obtener una tabla con el tiempo total, el porcentaje y el tiempo por llamada de cada fase,
+        seguida de los contadores.
+        :return: cadena con la tabla
+        """
+        total = sum(self.times.values())
+        lines = [f"{'phase':<16} {'seconds':>10} {'%':>7} {'calls':>12} {'us/call':>10}"]
+        for phase, seconds in self.times.items():
+            calls = self.calls[phase]
+            lines.append(f"{phase:<16} {seconds:>10.4f} {100 * seconds / total if total else 0:>7.2f} "
+                         f"{calls:>12d} {1e6 * seconds / calls if calls else 0:>10.3f}")
+        lines.append(f"{'total':<16} {total:>10.4f}")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<16} {value:>10d}")
+        return "\n".join(lines)
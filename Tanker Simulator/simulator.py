@@ -1,52 +1,160 @@
-import utils
+import os
+import argparse
 import numpy as np
 from tanker.tanker import Tanker
+from profiler import Profiler
 from controllers.rbf_network import RBFNetwork
 from controllers.neural_network import NeuralNetwork
 
 
-# Se declaran los parametros de la simulación
-mode = "ballast"  # full ballast
-ctrl_name = "nn"  # "rbf" or "nn"
-simulation_steps = 4000
-sampling_interval = 10
-initial_conditions = [0, 0, 0]
-
-# Se valida que el controlador seleccionado por el usuario sea un controlador valido
-assert ctrl_name in ["rbf", "nn"], "Controller name must be rbf or nn"
-# Se instancia el controlador correspondiente y se grafica su mapeo de entradas y salidas
-if ctrl_name == "nn":
-    controller = NeuralNetwork()
-else:
-    controller = RBFNetwork(sampling_interval)
-controller.plot_in_out_map()
-
-# Se instancia el objeto del tanker
-tanker = Tanker(mode, initial_conditions)
-
-# Se definen los valores iniciales para la referencia, entrada al sistema (rudder input)
-# y para el sistema
-reference, rudder_input = 45 * (np.pi / 180), 0
-x_0 = initial_conditions[0]
-
-psi, refs, rudder_hist = list(), list(), list()
-
-# Se inicia la simulacion por la cantidad de pasos indicada por el usuario.
-# Cada vez que se cumpla un periodo de muestreo (i % sampling_interval == 0)
-# se utiliza el controlador para obtener la nueva entrada del sistema (rudder_input).
-# Al llegar al paso de simulation 2000 cambiamos la referencia del controlador.
-# En cada instante de simulacion actualizamos el estado del sistema usando el objeto tanker.
-# Finalmente, guardamos las variables utilizadas para graficarlas mas adelante.
-for i in range(simulation_steps):
-
-    if i % sampling_interval == 0:
-        rudder_input = controller.predict(reference, x_0)
-    if i == 2000:
-        reference = 0
-    x_0 = tanker.run_step(rudder_input)[0]
-
-    psi.append(x_0*180/np.pi)
-    refs.append(reference * 180 / np.pi)
-    rudder_hist.append(rudder_input*(180/np.pi))
-
-utils.plot_hist(psi, refs, rudder_hist)
+def reference_schedule(steps):
+    """
+    Perfil de referencias de la simulacion: 45 grados hasta el paso 2000 y 0 grados desde ese paso.
+    :param steps: Arreglo con los pasos de simulacion
+    :return: Arreglo con la referencia (en radianes) de cada paso
+    """
+    return np.where(steps < 2000, 45 * (np.pi / 180), 0)
+
+
+def build_controller(ctrl_name, sampling_interval, controller_parameters=None):
+    """
+    Instancia el controlador indicado y reemplaza los parametros del modelo que indique el usuario.
+    :param ctrl_name: Nombre del controlador ("rbf" o "nn")
+    :param sampling_interval: Intervalo de muestreo del controlador
+    :param controller_parameters: Diccionario opcional {nombre del atributo: valor}, por ejemplo {"w112": 12}
+    :return: controlador
+    """
+    # Se valida que el controlador seleccionado por el usuario sea un controlador valido
+    assert ctrl_name in ["rbf", "nn"], "Controller name must be rbf or nn"
+    if ctrl_name == "nn":
+        controller = NeuralNetwork()
+    else:
+        controller = RBFNetwork(sampling_interval)
+    for name, value in (controller_parameters or {}).items():
+        assert hasattr(controller, name), f"Unknown parameter '{name}' for controller '{ctrl_name}'"
+        setattr(controller, name, value)
+    return controller
+
+
+def run_simulation(mode, ctrl_name, simulation_steps, sampling_interval, initial_conditions,
+                   controller_parameters=None, profiler=None):
+    """
+    Ejecuta una simulacion en lazo cerrado sin graficar.
+    :param mode: Modo del Tanker ("full", "ballast")
+    :param ctrl_name: Nombre del controlador ("rbf" o "nn")
+    :param simulation_steps: Numero de pasos de simulacion
+    :param sampling_interval: Intervalo de muestreo del controlador
+    :param initial_conditions: Condiciones iniciales del sistema [x1, x2, x3]
+    :param controller_parameters: Parametros del controlador (ver build_controller)
+    :param profiler: Profiler opcional donde se miden las fases de la simulacion (ver profiler.py)
+    :return: tupla (psi, refs, rudder_hist) con arreglos en radianes
+    """
+    controller = build_controller(ctrl_name, sampling_interval, controller_parameters)
+    tanker = Tanker(mode, initial_conditions, fast_mode=True)
+    return tanker.simulate(controller, simulation_steps, sampling_interval, reference_schedule, profiler=profiler)
+
+
+def stream_simulation(tanker, controller, steps, sampling_interval, reference_schedule, output,
+                      chunk_size=100000, profiler=None, monitor=None):
+    """
+    Ejecuta una simulacion en lazo cerrado escribiendo la trayectoria por bloques en un archivo .npy.
+    Cada bloque se simula sobre un arreglo de tamaño fijo y se copia a una ventana del archivo mapeada en
+    memoria que se libera al terminar el bloque, por lo que la memoria usada no depende del numero de pasos.
+    :param tanker: Objeto Tanker
+    :param controller: Controlador con el metodo predict(reference, angle)
+    :param steps: Numero de pasos de simulacion
+    :param sampling_interval: Intervalo de muestreo del controlador
+    :param reference_schedule: Perfil de referencias (ver Tanker.get_references)
+    :param output: Ruta del archivo .npy. Contiene un arreglo de forma (steps, 5) con las columnas
+                   [x1, x2, x3, referencia, señal de control] en radianes.
+    :param chunk_size: Numero de pasos por bloque
+    :param profiler: Profiler opcional (ver profiler.py). Ademas de las fases de Tanker.simulate mide la
+                     escritura de cada bloque en el archivo como la fase "output".
+    :param monitor: LiveMonitor opcional (ver monitor.py) que recibe cada bloque al terminar de simularlo
+    :return: trayectoria mapeada en memoria (solo lectura)
+    """
+    # Se crea el archivo con su encabezado y se guarda la posicion donde inician los datos
+    trajectory = np.lib.format.open_memmap(output, mode="w+", dtype=float, shape=(steps, 5))
+    data_offset = trajectory.offset
+    del trajectory
+
+    chunk = np.empty((min(chunk_size, steps), 5))
+    for start in range(0, steps, chunk_size):
+        length = min(chunk_size, steps - start)
+        tanker.simulate(controller, length, sampling_interval, reference_schedule, out=chunk[:length],
+                        profiler=profiler)
+        start_time = profiler.timer() if profiler is not None else None
+        window = np.memmap(output, dtype=float, mode="r+", offset=data_offset + start * chunk.strides[0],
+                           shape=(length, 5))
+        window[:] = chunk[:length]
+        window.flush()
+        del window
+        if profiler is not None:
+            profiler.add("output", profiler.timer() - start_time)
+        if monitor is not None:
+            monitor.update(chunk[:length])
+    return np.load(output, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador del tanker en lazo cerrado")
+    parser.add_argument("--mode", default="ballast", choices=["ballast", "full"], help="Modo del tanker")
+    parser.add_argument("--controller", default="nn", choices=["nn", "rbf"], help="Controlador")
+    parser.add_argument("--steps", type=int, default=4000, help="Numero de pasos de simulacion")
+    parser.add_argument("--sampling-interval", type=int, default=10, help="Intervalo de muestreo del controlador")
+    parser.add_argument("--initial-conditions", type=float, nargs=3, default=[0, 0, 0],
+                        help="Condiciones iniciales [x1, x2, x3]")
+    parser.add_argument("--integrator", default="rk4", choices=["rk4", "dopri5"],
+                        help="Integrador: rk4 de paso fijo o dopri5 adaptativo (Dormand-Prince)")
+    parser.add_argument("--rtol", type=float, default=1e-6, help="Tolerancia relativa del integrador dopri5")
+    parser.add_argument("--atol", type=float, default=1e-9, help="Tolerancia absoluta del integrador dopri5")
+    parser.add_argument("--output", default="trajectory.npy", help="Archivo .npy donde se guarda la trayectoria")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Pasos simulados por bloque (por defecto 100000, o 2000 con --monitor)")
+    parser.add_argument("--no-plot", action="store_true", help="No grafica (no importa matplotlib)")
+    parser.add_argument("--monitor", type=float, default=None, metavar="SECONDS",
+                        help="Grafica en vivo los ultimos SECONDS segundos de la simulacion")
+    parser.add_argument("--monitor-fps", type=float, default=10, help="Maximo de cuadros por segundo del monitor")
+    parser.add_argument("--plot-dir", help="Carpeta donde se guardan las graficas sin mostrarlas")
+    parser.add_argument("--profile", action="store_true", help="Imprime el tiempo de cada fase de la simulacion")
+    parser.add_argument("--profile-trace", help="Archivo .npy donde se guarda el tiempo de cada fase por paso")
+    args = parser.parse_args()
+
+    # Se instancia el controlador correspondiente y, si se va a graficar, se grafica su mapeo de entradas y salidas
+    controller = build_controller(args.controller, args.sampling_interval)
+    if args.plot_dir is not None:
+        os.makedirs(args.plot_dir, exist_ok=True)
+        controller.plot_in_out_map(output=os.path.join(args.plot_dir, "in_out_map.png"))
+    elif not args.no_plot:
+        controller.plot_in_out_map()
+
+    # Se instancia el objeto del tanker
+    tanker = Tanker(args.mode, args.initial_conditions, fast_mode=True, integrator=args.integrator, rtol=args.rtol,
+                    atol=args.atol)
+
+    # Se simula el sistema por la cantidad de pasos indicada por el usuario.
+    # Cada vez que se cumple un periodo de muestreo (i % sampling_interval == 0)
+    # el tanker utiliza el controlador para obtener la nueva entrada del sistema (rudder_input)
+    # y actualiza su estado en cada instante de simulacion. La trayectoria se guarda en args.output.
+    profiler = Profiler(trace=True) if args.profile_trace else (Profiler() if args.profile else None)
+    monitor = None
+    if args.monitor is not None:
+        from monitor import LiveMonitor
+        monitor = LiveMonitor(args.monitor, tanker.step, args.monitor_fps)
+    chunk_size = args.chunk_size or (2000 if monitor is not None else 100000)
+    stream_simulation(tanker, controller, args.steps, args.sampling_interval, reference_schedule,
+                      args.output, chunk_size, profiler, monitor)
+    if monitor is not None:
+        monitor.close()
+    if profiler is not None:
+        print(profiler.summary())
+        if args.profile_trace:
+            profiler.save_trace(args.profile_trace)
+
+    # Finalmente, graficamos los resultados leyendolos del archivo.
+    if args.plot_dir is not None:
+        import utils
+        utils.plot_trajectory_file(args.output, output=os.path.join(args.plot_dir, "history.png"))
+    elif not args.no_plot:
+        import utils
+        utils.plot_trajectory_file(args.output)
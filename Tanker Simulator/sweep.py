@@ -0,0 +1,128 @@
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from simulator import run_simulation
+
+
+# Parametros de la simulacion que acepta la malla. Cualquier otra llave se interpreta como
+# un parametro del controlador (por ejemplo "w112" para la red neuronal).
+SIMULATION_PARAMETERS = {"mode": "ballast",
+                         "ctrl_name": "nn",
+                         "simulation_steps": 4000,
+                         "sampling_interval": 10,
+                         "initial_conditions": [0, 0, 0]}
+
+METRICS = ["settling_time", "overshoot", "ise", "rudder_effort"]
+
+
+def expand_grid(grid):
+    """
+    Construye la lista de simulaciones correspondiente al producto cartesiano de la malla.
+    :param grid: Diccionario {nombre del parametro: lista de valores}
+    :return: lista de diccionarios, uno por simulacion, en un orden fijo
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def compute_metrics(psi, refs, rudder_hist, settling_band=0.02):
+    """
+    Computa las metricas de desempeño de una simulacion. Cada cambio en la referencia define un
+    escalon que se evalua desde el paso del cambio hasta el siguiente cambio.
+    :param psi: Angulo del barco en cada paso [rad]
+    :param refs: Referencia en cada paso [rad]
+    :param rudder_hist: Señal de control en cada paso [rad]
+    :param settling_band: Banda de establecimiento relativa al tamaño del escalon
+    :return: diccionario con
+        settling_time: mayor tiempo de establecimiento de los escalones [pasos] (nan si algun escalon no se establece)
+        overshoot: mayor sobrepaso de los escalones [% del tamaño del escalon]
+        ise: integral del error cuadratico del angulo [rad^2 s]
+        rudder_effort: integral del cuadrado de la señal de control [rad^2 s]
+    """
+    error = refs - psi
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(refs)) + 1))
+    ends = np.append(starts[1:], psi.shape[0])
+    settling_time, overshoot = 0.0, 0.0
+    for start, end in zip(starts, ends):
+        step = refs[start] - (psi[start - 1] if start > 0 else psi[0])
+        if step == 0:
+            continue
+        overshoot = max(overshoot, 100 * max(0.0, np.max(-error[start:end] * np.sign(step))) / abs(step))
+        outside = np.flatnonzero(np.abs(error[start:end]) > settling_band * abs(step))
+        if outside.shape[0] == 0:
+            continue
+        if outside[-1] == end - start - 1:
+            settling_time = np.nan
+        else:
+            settling_time = max(settling_time, outside[-1] + 1)
+    return {"settling_time": float(settling_time),
+            "overshoot": float(overshoot),
+            "ise": float(np.sum(np.square(error))),
+            "rudder_effort": float(np.sum(np.square(rudder_hist)))}
+
+
+def run_case(case):
+    """
+    Ejecuta una simulacion de la malla y computa sus metricas.
+    :param case: Diccionario con los parametros de la simulacion y del controlador
+    :return: diccionario con las metricas de la simulacion
+    """
+    parameters = dict(SIMULATION_PARAMETERS)
+    controller_parameters = dict()
+    for name, value in case.items():
+        if name in parameters:
+            parameters[name] = value
+        else:
+            controller_parameters[name] = value
+    # Las simulaciones inestables divergen; sus metricas quedan como inf o nan
+    with np.errstate(over="ignore", invalid="ignore"):
+        psi, refs, rudder_hist = run_simulation(controller_parameters=controller_parameters, **parameters)
+        return compute_metrics(psi, refs, rudder_hist)
+
+
+def run_sweep(grid, output=None, workers=None, chunksize=None):
+    """
+    Ejecuta todas las simulaciones de la malla repartidas en un conjunto de procesos.
+    Las simulaciones son deterministicas y los resultados se retornan en el orden de expand_grid,
+    por lo que no dependen del numero de procesos.
+    :param grid: Diccionario {nombre del parametro: lista de valores}
+    :param output: Ruta opcional de un archivo .npz donde se guarda una columna por parametro y por metrica
+    :param workers: Numero de procesos. Con 1 las simulaciones se ejecutan en el proceso actual.
+    :param chunksize: Numero de simulaciones que se envian juntas a cada proceso. Por defecto se
+                      reparten en cerca de 4 bloques por proceso.
+    :return: diccionario {nombre de la columna: arreglo}
+    """
+    cases = expand_grid(grid)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(cases) <= 1:
+        results = [run_case(case) for case in cases]
+    else:
+        chunksize = chunksize or max(1, len(cases) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_case, cases, chunksize=chunksize))
+
+    columns = {name: np.array([case[name] for case in cases]) for name in grid}
+    columns.update({metric: np.array([result[metric] for result in results]) for metric in METRICS})
+    if output is not None:
+        np.savez(output, **columns)
+    return columns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido de parametros del simulador del tanker")
+    parser.add_argument("--grid", help="Archivo JSON con la malla {parametro: [valores]}")
+    parser.add_argument("--output", default="sweep.npz", help="Archivo .npz de resultados")
+    parser.add_argument("--workers", type=int, default=None, help="Numero de procesos")
+    parser.add_argument("--chunksize", type=int, default=None, help="Simulaciones por tarea")
+    args = parser.parse_args()
+
+    if args.grid is None:
+        sweep_grid = {"mode": ["ballast", "full"], "ctrl_name": ["nn", "rbf"], "sampling_interval": [5, 10, 20]}
+    else:
+        with open(args.grid) as grid_file:
+            sweep_grid = json.load(grid_file)
+    sweep_results = run_sweep(sweep_grid, args.output, args.workers, args.chunksize)
+    print(f"{len(sweep_results[METRICS[0]])} simulations saved to {args.output}")
@@ -0,0 +1,132 @@
+import numpy as np
+from tanker.tanker import compute_parameters
+
+
+class BatchTanker:
+    """
+    Esta clase implementa el modelo dinamico de N Tankers independientes que se integran
+    en paralelo. El estado se almacena en un arreglo de forma (N, 3) y cada barco tiene sus
+    propios parametros a, b, c y d, por lo que es posible mezclar barcos en modo "ballast" y "full".
+    """
+    def __init__(self, modes, initial_conditions, integration_step=1):
+        """
+        Constructor de la clase
+        :param modes: Modo de cada Tanker ("full", "ballast"). Puede ser un unico modo para todos los barcos
+                      o una secuencia con un modo por barco.
+        :param initial_conditions: Condiciones iniciales de los barcos con forma (N, 3), o una unica condicion
+                                   inicial de forma (3,) que se replica para todos los barcos.
+        :param integration_step: Paso de integracion requerido por el metodo runge kutta
+        """
+        initial_conditions = np.array(initial_conditions, dtype=float)
+        if isinstance(modes, str):
+            assert initial_conditions.ndim == 2, \
+                "A list of modes or (N, 3) initial conditions is needed to know the number of ships"
+            modes = [modes] * initial_conditions.shape[0]
+        modes = list(modes)
+        for mode in modes:
+            assert mode in ["ballast", "full"], "Tanker mode should be 'ballast' or 'full'"
+        self.num_ships = len(modes)
+        self.modes = modes
+        self.x = np.array(np.broadcast_to(initial_conditions, (self.num_ships, 3)))
+        self.step = integration_step
+        self.a, self.b, self.c, self.d = self.init_parameters()
+        self.sim_time = 0
+        self.init_buffers()
+
+    def init_parameters(self):
+        """
+        Metodo para inicializar los parametros de cada barco basado en su modo de operacion.
+        :return: arreglos de forma (N,) con los parametros a, b, c y d
+        """
+        parameters = {mode: compute_parameters(mode) for mode in set(self.modes)}
+        table = np.array([parameters[mode] for mode in self.modes]).reshape(self.num_ships, 4)
+        return tuple(np.ascontiguousarray(table[:, i]) for i in range(4))
+
+    def init_buffers(self):
+        """
+        Metodo para reservar los arreglos auxiliares usados por el metodo de runge kutta.
+        Se reservan una unica vez para que cada paso de simulacion no cree arreglos nuevos.
+        :return:
+        """
+        n = self.num_ships
+        self._ks = np.empty((4, n, 3))
+        self._x_stage = np.empty((n, 3))
+        self._u = np.empty(n)
+        self._cu = np.empty(n)
+        self._du = np.empty(n)
+        self._tmp = np.empty(n)
+
+    def compute_derivatives(self, x, out):
+        """
+        Este metodo evalua las ecuaciones del tanker (paginas 119 y 121 del libro de Kevin)
+        para todos los barcos, multiplicadas por el paso de integracion.
+        Utiliza las entradas c*u y d*u precomputadas en run_step.
+        :param x: Estado de los barcos con forma (N, 3)
+        :param out: Arreglo de forma (N, 3) donde se escribe el resultado
+        :return: out
+        """
+        tmp = self._tmp
+        out[:, 0] = x[:, 1]
+        np.add(x[:, 2], self._cu, out=out[:, 1])
+        np.multiply(x[:, 1], x[:, 1], out=tmp)
+        tmp *= x[:, 1]
+        tmp += x[:, 1]
+        tmp *= self.b
+        np.multiply(self.a, out[:, 1], out=out[:, 2])
+        out[:, 2] += tmp
+        np.subtract(self._du, out[:, 2], out=out[:, 2])
+        out *= self.step
+        return out
+
+    def compute_runge_kutta_step(self):
+        """
+        Este metodo computa un paso del metodo de runge kutta para todos los barcos a la vez.
+        Las etapas son las mismas de Tanker.compute_runge_kutta_step, pero el estado se
+        actualiza en sitio sobre los arreglos reservados en init_buffers.
+        :return: nuevo estado de los barcos
+        """
+        ks, x_stage = self._ks, self._x_stage
+        x_stage[...] = self.x
+        for it in range(4):
+            self.compute_derivatives(x_stage, ks[it])
+            if it < 3:
+                x_stage += ks[it] / 2 if it < 2 else ks[it]
+        ks[1] *= 2
+        ks[2] *= 2
+        self.x += ks.sum(axis=0) / 6
+        return self.x
+
+    def keep(self, indexes):
+        """
+        Metodo para conservar solo algunos barcos, por ejemplo para dejar de simular los que ya no interesan.
+        :param indexes: Indices (o mascara booleana) de los barcos que se conservan
+        :return:
+        """
+        indexes = np.arange(self.num_ships)[indexes]
+        self.modes = [self.modes[i] for i in indexes]
+        self.num_ships = len(self.modes)
+        self.x = self.x[indexes]
+        self.a, self.b, self.c, self.d = (parameter[indexes] for parameter in (self.a, self.b, self.c, self.d))
+        self.init_buffers()
+
+    def reset(self):
+        """
+        Metodo para reiniciar el tiempo de simulacion.
+        :return:
+        """
+        self.sim_time = 0
+
+    def run_step(self, rudder_inputs):
+        """
+        Metodo para obtener el nuevo estado de todos los barcos de acuerdo a sus acciones de control
+        :param rudder_inputs: Señales de control, un escalar o un arreglo de forma (N,)
+        :return: Nuevo estado de los barcos con forma (N, 3)
+        """
+        np.copyto(self._u, rudder_inputs)
+        np.multiply(self.c, self._u, out=self._cu)
+        np.multiply(self.d, self._u, out=self._du)
+        if self.sim_time == 0:
+            np.negative(self._cu, out=self.x[:, 2])
+        self.compute_runge_kutta_step()
+        self.sim_time += 1
+        return self.x
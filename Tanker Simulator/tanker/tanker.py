@@ -2,54 +2,99 @@ import copy
 import numpy as np
 
 
+def compute_parameters(mode):
+    """
+    Computa los parametros a, b, c y d del tanker para el modo de operacion indicado.
+    El computo de los parametros se realiza de la manera descrita en la pagina
+    120 del libro de Kevin.
+    :param mode: Modo del Tanker ("full", "ballast")
+    :return: parametros a, b, c y d
+    """
+    ell, u = 350, 5
+    if mode == "ballast":
+        k_0 = 5.88
+        tau_10 = -16.91
+        tau_20 = 0.45
+        tau_30 = 1.43
+    else:
+        k_0 = 0.83
+        tau_10 = -2.88
+        tau_20 = 0.38
+        tau_30 = 1.07
+
+    k = k_0 * (u / ell)
+    tau_1 = tau_10 * (ell / u)
+    tau_2 = tau_20 * (ell / u)
+    tau_3 = tau_30 * (ell / u)
+
+    a = ((1/tau_1)+(1/tau_2))
+    b = (1/(tau_1*tau_2))
+    c = (k*tau_3/(tau_1*tau_2))
+    d = k/(tau_1*tau_2)
+    return a, b, c, d
+
+
+# Coeficientes del metodo de Dormand-Prince (RK45). DOPRI_A[i] contiene los coeficientes de la etapa i+1,
+# la ultima fila es la solucion de quinto orden y DOPRI_E la diferencia con la solucion de cuarto orden.
+DOPRI_A = [[1/5],
+           [3/40, 9/40],
+           [44/45, -56/15, 32/9],
+           [19372/6561, -25360/2187, 64448/6561, -212/729],
+           [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+           [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+DOPRI_E = [71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+
+def no_timer():
+    # Reloj de simulate cuando no se mide el tiempo de las fases
+    return 0.0
+
+
 class Tanker:
     """
     Esta clase implementa el modelo dinamico del Tanker
     """
-    def __init__(self, mode, initial_conditions=4000, integration_step=1):
+    def __init__(self, mode, initial_conditions=4000, integration_step=1, fast_mode=False,
+                 integrator="rk4", rtol=1e-6, atol=1e-9):
         """
         Constructor de la clase
         :param mode: Modo del Tanker ("full", "ballast")
         :param initial_conditions: Condiciones iniciales del sistema
         :param integration_step: Paso de integracion requerido por el metodo runge kutta
+        :param fast_mode: Si es True, run_step actualiza el estado en sitio usando
+                          compute_runge_kutta_step_fast, sin crear arreglos en cada paso.
+        :param integrator: "rk4" integra con paso fijo integration_step. "dopri5" integra con el metodo
+                           adaptativo de Dormand-Prince, que toma los pasos que permita la tolerancia
+                           pero siempre termina exactamente en los instantes de muestreo.
+                           En ambos casos el estado se reporta cada integration_step.
+        :param rtol: Tolerancia relativa del integrador adaptativo
+        :param atol: Tolerancia absoluta del integrador adaptativo
         """
         assert mode in ["ballast", "full"], "Tanker mode should be 'ballast' or 'full'"
+        assert integrator in ["rk4", "dopri5"], "Tanker integrator should be 'rk4' or 'dopri5'"
         self.mode = mode
-        self.x = np.array(initial_conditions)
+        self.x = np.array(initial_conditions, dtype=float)
         self.step = integration_step
+        self.fast_mode = fast_mode
+        self.integrator = integrator
+        self.rtol, self.atol = rtol, atol
         self.a, self.b, self.c, self.d = self.init_parameters()
         self.sim_time = 0
+        self.rudder_input = 0
+        # Numero de evaluaciones de las ecuaciones del sistema y ultimo paso aceptado del integrador adaptativo
+        self.rhs_evaluations = 0
+        self.adaptive_step = integration_step
+        # Ultimo estado aceptado del integrador adaptativo, su señal de control y sus derivadas. Si la siguiente
+        # llamada parte del mismo estado con la misma señal, reutiliza las derivadas (FSAL) sin evaluarlas
+        self.fsal = None
 
     def init_parameters(self):
         """
         Metodo para inicializar los parametros del tanker basado en el modo de operacion
         indicado por el usuario.
-        El computo de los parametros a, b, c y d se realiza de la manera descrita  en la pagina
-        120 del libro de Kevin.
         :return: parametros a, b, c y d
         """
-        ell, u = 350, 5
-        if self.mode == "ballast":
-            k_0 = 5.88
-            tau_10 = -16.91
-            tau_20 = 0.45
-            tau_30 = 1.43
-        else:
-            k_0 = 0.83
-            tau_10 = -2.88
-            tau_20 = 0.38
-            tau_30 = 1.07
-
-        k = k_0 * (u / ell)
-        tau_1 = tau_10 * (ell / u)
-        tau_2 = tau_20 * (ell / u)
-        tau_3 = tau_30 * (ell / u)
-
-        a = ((1/tau_1)+(1/tau_2))
-        b = (1/(tau_1*tau_2))
-        c = (k*tau_3/(tau_1*tau_2))
-        d = k/(tau_1*tau_2)
-        return a, b, c, d
+        return compute_parameters(self.mode)
 
     def compute_runge_kutta_step(self, x, rudder_input):
         """
@@ -73,24 +118,320 @@ class Tanker:
                 x_new = x_new + k
         return x + (1/6)*(ks[0]+2*ks[1]+2*ks[2]+ks[3])
 
+    def compute_runge_kutta_step_fast(self, x1, x2, x3, rudder_input):
+        """
+        Version escalar de compute_runge_kutta_step. Recibe y retorna el estado como
+        numeros de punto flotante, por lo que no crea arreglos de numpy en cada paso.
+        Las etapas del metodo son las mismas de compute_runge_kutta_step.
+        :param x1: Primer estado del sistema (angulo del barco)
+        :param x2: Segundo estado del sistema
+        :param x3: Tercer estado del sistema
+        :param rudder_input: Señal de control
+        :return: nuevo estado del sistema (x1, x2, x3)
+        """
+        a, b, h = self.a, self.b, self.step
+        cu, du = self.c*rudder_input, self.d*rudder_input
+        # Etapa 1
+        y = x3 + cu
+        k11, k12, k13 = h*x2, h*y, h*(du - a*y - b*(x2*x2*x2 + x2))
+        s1, s2, s3 = x1 + 0.5*k11, x2 + 0.5*k12, x3 + 0.5*k13
+        # Etapa 2
+        y = s3 + cu
+        k21, k22, k23 = h*s2, h*y, h*(du - a*y - b*(s2*s2*s2 + s2))
+        s1, s2, s3 = s1 + 0.5*k21, s2 + 0.5*k22, s3 + 0.5*k23
+        # Etapa 3
+        y = s3 + cu
+        k31, k32, k33 = h*s2, h*y, h*(du - a*y - b*(s2*s2*s2 + s2))
+        s2, s3 = s2 + k32, s3 + k33
+        # Etapa 4
+        y = s3 + cu
+        k41, k42, k43 = h*s2, h*y, h*(du - a*y - b*(s2*s2*s2 + s2))
+        return (x1 + (k11 + 2*k21 + 2*k31 + k41)/6,
+                x2 + (k12 + 2*k22 + 2*k32 + k42)/6,
+                x3 + (k13 + 2*k23 + 2*k33 + k43)/6)
+
+    def compute_derivatives(self, x1, x2, x3, rudder_input):
+        """
+        Este metodo evalua las ecuaciones del sistema descritas en las paginas 119 y 121 del libro de Kevin.
+        :param x1: Primer estado del sistema (angulo del barco)
+        :param x2: Segundo estado del sistema
+        :param x3: Tercer estado del sistema
+        :param rudder_input: Señal de control
+        :return: derivadas de los estados (dx1, dx2, dx3)
+        """
+        y = x3 + self.c*rudder_input
+        return x2, y, self.d*rudder_input - self.a*y - self.b*(x2*x2*x2 + x2)
+
+    def integrate_adaptive(self, x1, x2, x3, rudder_input, n_steps, out=None):
+        """
+        Este metodo integra el sistema con el metodo de Dormand-Prince durante n_steps pasos de integracion
+        (n_steps*integration_step segundos) manteniendo constante la señal de control.
+        El tamaño de cada paso se ajusta para que el error local estimado cumpla las tolerancias rtol y atol,
+        y el ultimo paso se recorta para terminar exactamente al final del intervalo. El tamaño del ultimo paso
+        no recortado y las derivadas del estado final (ver fsal) se conservan para la siguiente llamada.
+        Los estados en los instantes intermedios k*integration_step se obtienen por interpolacion de Hermite
+        cubica entre los extremos de cada paso aceptado, sin evaluar de nuevo las ecuaciones del sistema.
+        :param x1: Primer estado del sistema (angulo del barco)
+        :param x2: Segundo estado del sistema
+        :param x3: Tercer estado del sistema
+        :param rudder_input: Señal de control
+        :param n_steps: Numero de pasos de integracion del intervalo
+        :param out: Arreglo opcional de forma (n_steps, >=3) donde se escribe el estado de cada paso de integracion
+        :return: estado al final del intervalo (x1, x2, x3)
+        """
+        derivatives = self.compute_derivatives
+        t, t_end = 0.0, n_steps*self.step
+        y = (x1, x2, x3)
+        if self.fsal is not None and self.fsal[0] == y and self.fsal[1] == rudder_input:
+            k1 = self.fsal[2]
+        else:
+            k1 = derivatives(*y, rudder_input)
+            self.rhs_evaluations += 1
+        h = min(self.adaptive_step, t_end)
+        next_output = 1
+        while t < t_end:
+            last = t + h >= t_end*(1 - 1e-12)
+            if last:
+                h = t_end - t
+            ks = [k1]
+            for coefficients in DOPRI_A:
+                stage = tuple(y[i] + h*sum(a*k[i] for a, k in zip(coefficients, ks)) for i in range(3))
+                ks.append(derivatives(*stage, rudder_input))
+            self.rhs_evaluations += 6
+            # stage es la solucion de quinto orden y ks[6] sus derivadas (FSAL)
+            error = 0.0
+            for i in range(3):
+                scale = self.atol + self.rtol*max(abs(y[i]), abs(stage[i]))
+                error += (h*sum(e*k[i] for e, k in zip(DOPRI_E, ks))/scale)**2
+            error = (error/3)**0.5
+            factor = 5.0 if error == 0 else min(5.0, max(0.2, 0.9*error**-0.2))
+            if not np.isfinite(y[0] + y[1] + y[2]):
+                # La simulacion ya diverge: se termina el intervalo en un solo paso
+                last, h = True, t_end - t
+            elif not error <= 1 and h > 1e-6*self.step:
+                h *= min(1.0, factor)
+                continue
+
+            t_new = t_end if last else t + h
+            if out is not None:
+                self.write_dense_output(out, next_output, t, t_new, y, k1, stage, ks[6])
+                next_output = min(n_steps, int((t_new + 1e-9*self.step)/self.step)) + 1
+            t, y, k1 = t_new, stage, ks[6]
+            if not last:
+                self.adaptive_step = h = h*factor
+        self.fsal = (y, rudder_input, k1)
+        return y
+
+    def write_dense_output(self, out, next_output, t0, t1, y0, f0, y1, f1):
+        """
+        Escribe en out los estados de los pasos de integracion que caen en el intervalo (t0, t1],
+        interpolando con el polinomio de Hermite cubico definido por los estados y derivadas en los extremos.
+        :param out: Arreglo de salida (fila k-1 para el instante k*integration_step)
+        :param next_output: Primer instante (en pasos de integracion) que aun no se ha escrito
+        :param t0: Tiempo inicial del paso aceptado (relativo al inicio del intervalo)
+        :param t1: Tiempo final del paso aceptado
+        :param y0: Estado en t0
+        :param f0: Derivadas en t0
+        :param y1: Estado en t1
+        :param f1: Derivadas en t1
+        """
+        last_output = min(out.shape[0], int((t1 + 1e-9*self.step)/self.step))
+        h = t1 - t0
+        for k in range(next_output, last_output + 1):
+            if abs(k*self.step - t1) <= 1e-9*self.step:
+                # El extremo del paso se copia sin interpolar
+                out[k - 1, :3] = y1
+                continue
+            theta = (k*self.step - t0)/h
+            theta2 = theta*theta
+            theta3 = theta2*theta
+            h00, h10 = 2*theta3 - 3*theta2 + 1, (theta3 - 2*theta2 + theta)*h
+            h01, h11 = 3*theta2 - 2*theta3, (theta3 - theta2)*h
+            out[k - 1, :3] = (h00*y0[0] + h10*f0[0] + h01*y1[0] + h11*f1[0],
+                              h00*y0[1] + h10*f0[1] + h01*y1[1] + h11*f1[1],
+                              h00*y0[2] + h10*f0[2] + h01*y1[2] + h11*f1[2])
+
     def reset(self):
         """
         Metodo para reiniciar el tiempo de simulacion.
         :return:
         """
         self.sim_time = 0
+        self.rudder_input = 0
 
     def run_step(self, rudder_input):
         """
         Metodo usado por el simulador para obtener el nuevo estado del sistema de acuerdo
         a la accion de control rudder input
+        Con el integrador "dopri5" cada llamada integra un solo paso de integracion, que termina exactamente en
+        el siguiente instante, por lo que cuesta 6 evaluaciones de las ecuaciones (4 con "rk4"). El integrador
+        adaptativo solo ahorra evaluaciones con simulate, que integra cada intervalo de muestreo completo.
         :param rudder_input: Señal de control
         :return: Nuevo estado del sistema
         """
         if self.sim_time == 0:
             self.x[2] = -self.c*rudder_input
-        self.x = self.compute_runge_kutta_step(self.x, rudder_input)
+        x = self.x
+        if self.integrator == "dopri5":
+            x[0], x[1], x[2] = self.integrate_adaptive(float(x[0]), float(x[1]), float(x[2]), rudder_input, 1)
+        elif self.fast_mode:
+            x[0], x[1], x[2] = self.compute_runge_kutta_step_fast(float(x[0]), float(x[1]), float(x[2]),
+                                                                  rudder_input)
+            self.rhs_evaluations += 4
+        else:
+            self.x = self.compute_runge_kutta_step(x, rudder_input)
+            self.rhs_evaluations += 4
         self.sim_time += 1
         return self.x
 
+    def get_references(self, reference_schedule, steps):
+        """
+        Metodo para evaluar el perfil de referencias en los siguientes pasos de simulacion.
+        :param reference_schedule: Referencia constante, arreglo con la referencia de cada paso
+                                   (indexado por el tiempo de simulacion) o funcion vectorizada que
+                                   recibe un arreglo con los pasos de simulacion y retorna sus referencias.
+        :param steps: Numero de pasos a evaluar a partir del tiempo de simulacion actual
+        :return: arreglo de forma (steps,) con las referencias
+        """
+        if callable(reference_schedule):
+            references = reference_schedule(np.arange(self.sim_time, self.sim_time + steps))
+        else:
+            references = np.asarray(reference_schedule, dtype=float)
+            if references.ndim > 0:
+                references = references[self.sim_time:self.sim_time + steps]
+                assert references.shape[0] == steps, "The reference schedule is shorter than the simulation"
+        return np.broadcast_to(np.asarray(references, dtype=float), (steps,))
+
+    def simulate(self, controller, steps, sampling_interval, reference_schedule, out=None, profiler=None):
+        """
+        Metodo para simular el sistema en lazo cerrado durante varios pasos.
+        Cada vez que se cumple un periodo de muestreo (sim_time % sampling_interval == 0) se utiliza
+        el controlador para obtener la nueva entrada del sistema, que se mantiene hasta el siguiente
+        muestreo. Con el integrador "rk4" el estado se integra con compute_runge_kutta_step_fast; con
+        "dopri5" cada intervalo entre muestreos se integra con integrate_adaptive. Los resultados se escriben
+        en un arreglo reservado de antemano, por lo que no se crean arreglos en cada paso.
+        Llamadas sucesivas continuan la simulacion desde el estado y tiempo actuales.
+        :param controller: Controlador con el metodo predict(reference, angle)
+        :param steps: Numero de pasos de simulacion
+        :param sampling_interval: Intervalo de muestreo del controlador
+        :param reference_schedule: Perfil de referencias en radianes (ver get_references)
+        :param out: Arreglo opcional de forma (steps, 5) donde se escriben, por paso, el estado
+                    [x1, x2, x3], la referencia y la señal de control.
+        :param profiler: Profiler opcional (ver profiler.py) donde se acumulan el tiempo de cada fase y los
+                         contadores de la simulacion.
+        :return: tupla (heading, reference, rudder) con arreglos de forma (steps,) en radianes.
+                 Son vistas sobre out.
+        """
+        if out is None:
+            out = np.empty((steps, 5))
+        assert out.shape == (steps, 5), "The output array must have shape (steps, 5)"
+        out[:, 3] = self.get_references(reference_schedule, steps)
+        references = out[:, 3].tolist()
+
+        if profiler is None:
+            timer, trace = no_timer, None
+        else:
+            timer, trace = profiler.timer, (np.empty((steps, 4)) if profiler.trace else None)
+        rhs_evaluations = self.rhs_evaluations
+        loop = self.simulate_dopri5 if self.integrator == "dopri5" else self.simulate_rk4
+        phase_times, predictions, calls, rows = loop(controller, sampling_interval, references, out, timer, trace)
+        if profiler is not None:
+            controller_time, plant_time, recording_time = phase_times
+            profiler.add("controller", controller_time, predictions)
+            profiler.add("plant", plant_time, calls)
+            profiler.add("recording", recording_time, calls)
+            profiler.count("steps", steps)
+            profiler.count("predictions", predictions)
+            profiler.count("rhs_evaluations", self.rhs_evaluations - rhs_evaluations)
+            if trace is not None:
+                profiler.add_trace(trace[:rows])
+        return out[:, 0], out[:, 3], out[:, 4]
+
+    def simulate_rk4(self, controller, sampling_interval, references, out, timer, trace):
+        """
+        Ciclo de simulate con el integrador "rk4": un paso de compute_runge_kutta_step_fast por paso de simulacion.
+        Continua desde el estado y tiempo actuales y los actualiza al terminar.
+        Los tiempos de las fases (evaluacion del controlador, integracion de la planta y registro de la
+        trayectoria) se miden con timer; sin profiler, timer es no_timer y las fases suman 0.
+        :param controller: Controlador con el metodo predict(reference, angle)
+        :param sampling_interval: Intervalo de muestreo del controlador
+        :param references: Lista con la referencia de cada paso
+        :param out: Arreglo de forma (steps, 5) donde se escribe la trayectoria
+        :param timer: Funcion sin argumentos que retorna el tiempo actual en segundos
+        :param trace: Arreglo opcional de forma (steps, 4) donde se escriben el paso y el tiempo de cada fase
+        :return: tupla (phase_times, predictions, calls, rows): tiempo de cada fase, numero de evaluaciones del
+                 controlador, numero de pasos de la planta y numero de filas escritas en trace
+        """
+        steps = out.shape[0]
+        x1, x2, x3 = (float(value) for value in self.x)
+        rudder_input = self.rudder_input
+        sim_time = self.sim_time
+        controller_time, plant_time, recording_time = 0.0, 0.0, 0.0
+        predictions = 0
+        step_fast = self.compute_runge_kutta_step_fast
+        for i in range(steps):
+            t_0 = timer()
+            if sim_time % sampling_interval == 0:
+                rudder_input = float(controller.predict(references[i], x1))
+                predictions += 1
+            t_1 = timer()
+            if sim_time == 0:
+                x3 = -self.c*rudder_input
+            x1, x2, x3 = step_fast(x1, x2, x3, rudder_input)
+            t_2 = timer()
+            out[i] = (x1, x2, x3, references[i], rudder_input)
+            t_3 = timer()
+            controller_time += t_1 - t_0
+            plant_time += t_2 - t_1
+            recording_time += t_3 - t_2
+            if trace is not None:
+                trace[i] = (sim_time, t_1 - t_0, t_2 - t_1, t_3 - t_2)
+            sim_time += 1
+        self.rhs_evaluations += 4*steps
+
+        self.x[0], self.x[1], self.x[2] = x1, x2, x3
+        self.rudder_input = rudder_input
+        self.sim_time = sim_time
+        return (controller_time, plant_time, recording_time), predictions, steps, steps
+
+    def simulate_dopri5(self, controller, sampling_interval, references, out, timer, trace):
+        """
+        Ciclo de simulate con el integrador "dopri5": cada intervalo entre muestreos se integra con
+        integrate_adaptive. Las fases se miden por intervalo de muestreo y el registro de los estados
+        interpolados queda incluido en la planta. Los parametros y el resultado son los de simulate_rk4;
+        trace tiene una fila por intervalo.
+        """
+        steps = out.shape[0]
+        x1, x2, x3 = (float(value) for value in self.x)
+        rudder_input = self.rudder_input
+        sim_time = self.sim_time
+        controller_time, plant_time, recording_time = 0.0, 0.0, 0.0
+        predictions, calls = 0, 0
+        i = 0
+        while i < steps:
+            t_0 = timer()
+            if sim_time % sampling_interval == 0:
+                rudder_input = float(controller.predict(references[i], x1))
+                predictions += 1
+            t_1 = timer()
+            if sim_time == 0:
+                x3 = -self.c*rudder_input
+            # El intervalo termina en el siguiente instante de muestreo o al final de la simulacion
+            n_steps = min(sampling_interval - sim_time % sampling_interval, steps - i)
+            x1, x2, x3 = self.integrate_adaptive(x1, x2, x3, rudder_input, n_steps, out=out[i:i + n_steps])
+            t_2 = timer()
+            out[i:i + n_steps, 4] = rudder_input
+            t_3 = timer()
+            controller_time += t_1 - t_0
+            plant_time += t_2 - t_1
+            recording_time += t_3 - t_2
+            if trace is not None:
+                trace[calls] = (sim_time, t_1 - t_0, t_2 - t_1, t_3 - t_2)
+            i += n_steps
+            sim_time += n_steps
+            calls += 1
 
+        self.x[0], self.x[1], self.x[2] = x1, x2, x3
+        self.rudder_input = rudder_input
+        self.sim_time = sim_time
+        return (controller_time, plant_time, recording_time), predictions, calls, calls
@@ -0,0 +1,176 @@
+import json
+import argparse
+import numpy as np
+from tanker.batch_tanker import BatchTanker
+from simulator import build_controller, reference_schedule
+from controllers.rbf_network import RBFNetwork
+
+
+def get_parameter_vector(controller):
+    """
+    Obtiene los parametros ajustables del controlador como un vector.
+    Para la red neuronal son los pesos y sesgos de get_parameters, para la red RBF es la tabla b.
+    :param controller: Controlador (NeuralNetwork o RBFNetwork)
+    :return: arreglo de forma (n_parameters,)
+    """
+    if isinstance(controller, RBFNetwork):
+        return np.array(controller.b, dtype=float)
+    return np.array(list(controller.get_parameters().values()), dtype=float)
+
+
+def set_parameter_vector(controller, vector):
+    """
+    Reemplaza los parametros ajustables del controlador.
+    Si vector tiene forma (P, n_parameters), cada parametro queda como un arreglo de P valores y el
+    controlador evalua P candidatos a la vez (get_model_output recibe una entrada por candidato).
+    :param controller: Controlador (NeuralNetwork o RBFNetwork)
+    :param vector: arreglo de forma (n_parameters,) o (P, n_parameters)
+    :return:
+    """
+    vector = np.asarray(vector, dtype=float)
+    if isinstance(controller, RBFNetwork):
+        controller.b = vector
+    else:
+        for k, name in enumerate(controller.get_parameters()):
+            setattr(controller, name, vector[..., k])
+
+
+def default_bounds(ctrl_name, vector):
+    """
+    Limites de busqueda por defecto alrededor de los parametros del libro.
+    Para la red neuronal cada parametro puede variar en max(|valor|, 1); para la red RBF cada
+    peso de la tabla b puede tomar valores entre -80 y 80 grados, como los pesos del libro.
+    :param ctrl_name: Nombre del controlador ("nn" o "rbf")
+    :param vector: Parametros del libro
+    :return: tupla (minimos, maximos)
+    """
+    if ctrl_name == "rbf":
+        limit = np.full_like(vector, 80 * np.pi / 180)
+        return -limit, limit
+    width = np.maximum(np.abs(vector), 1)
+    return vector - width, vector + width
+
+
+def evaluate_population(ctrl_name, population, mode="ballast", simulation_steps=4000, sampling_interval=10,
+                        initial_conditions=(0, 0, 0), effort_weight=0.01, prune_costs=None):
+    """
+    Evalua el costo en lazo cerrado de una poblacion de parametros en una unica simulacion vectorizada:
+    cada candidato controla su propio barco de un BatchTanker.
+    El costo es la suma en el tiempo de error^2 + effort_weight*rudder^2. Como el costo solo puede crecer,
+    un candidato cuyo costo parcial supera su prune_cost ya no puede mejorarlo y deja de simularse.
+    :param ctrl_name: Nombre del controlador ("nn" o "rbf")
+    :param population: Parametros de los candidatos, arreglo de forma (P, n_parameters)
+    :param mode: Modo del tanker ("ballast" o "full")
+    :param simulation_steps: Numero de pasos de simulacion
+    :param sampling_interval: Intervalo de muestreo del controlador
+    :param initial_conditions: Condiciones iniciales [x1, x2, x3] de todos los barcos
+    :param effort_weight: Peso del esfuerzo de control en el costo
+    :param prune_costs: Costo a partir del cual se abandona cada candidato, escalar o arreglo de forma (P,)
+    :return: arreglo de forma (P,) con el costo de cada candidato (el costo parcial para los abandonados
+             e infinito para los que divergen)
+    """
+    population = np.asarray(population, dtype=float)
+    n_candidates = population.shape[0]
+    controller = build_controller(ctrl_name, sampling_interval)
+    set_parameter_vector(controller, population)
+    tanker = BatchTanker(mode, np.tile(np.asarray(initial_conditions, dtype=float), (n_candidates, 1)))
+    if isinstance(controller, RBFNetwork):
+        controller.last_error = np.zeros(n_candidates)
+    prune_costs = np.broadcast_to(np.inf if prune_costs is None else prune_costs, (n_candidates,)).astype(float)
+
+    references = np.broadcast_to(reference_schedule(np.arange(simulation_steps)), (simulation_steps,))
+    costs = np.zeros(n_candidates)
+    active = np.arange(n_candidates)
+    active_costs = np.zeros(n_candidates)
+    rudder_inputs = np.zeros(n_candidates)
+    with np.errstate(over="ignore", invalid="ignore"):
+        for step in range(simulation_steps):
+            if step % sampling_interval == 0:
+                if step > 0:
+                    # Se dejan de simular los candidatos que divergen o que ya superaron su costo limite
+                    keep = np.isfinite(active_costs) & (active_costs <= prune_costs[active])
+                    if not np.all(keep):
+                        costs[active[~keep]] = np.where(np.isfinite(active_costs[~keep]), active_costs[~keep], np.inf)
+                        active, active_costs = active[keep], active_costs[keep]
+                        if active.shape[0] == 0:
+                            return costs
+                        tanker.keep(keep)
+                        set_parameter_vector(controller, population[active])
+                        if isinstance(controller, RBFNetwork):
+                            controller.last_error = controller.last_error[keep]
+                rudder_inputs = controller.get_model_output(*controller.compute_inputs(references[step],
+                                                                                      tanker.x[:, 0]))
+            tanker.run_step(rudder_inputs)
+            error = references[step] - tanker.x[:, 0]
+            active_costs += error * error + effort_weight * rudder_inputs * rudder_inputs
+    costs[active] = np.where(np.isfinite(active_costs), active_costs, np.inf)
+    return costs
+
+
+def tune(ctrl_name, n_particles=40, n_iterations=50, bounds=None, seed=0, inertia=0.72, cognitive=1.49,
+         social=1.49, verbose=False, **simulation_parameters):
+    """
+    Ajusta los parametros del controlador con optimizacion por enjambre de particulas (PSO).
+    En cada iteracion toda la poblacion se evalua con evaluate_population. El costo limite de cada
+    particula es su mejor costo historico, por lo que abandonar candidatos no cambia el resultado.
+    La primera particula inicia en los parametros del libro, por lo que el resultado nunca es peor que ellos.
+    :param ctrl_name: Nombre del controlador ("nn" o "rbf")
+    :param n_particles: Numero de particulas
+    :param n_iterations: Numero de iteraciones
+    :param bounds: Tupla (minimos, maximos) de los parametros. Por defecto default_bounds
+    :param seed: Semilla del generador aleatorio
+    :param inertia: Peso de inercia de la velocidad
+    :param cognitive: Peso de la atraccion hacia el mejor punto de cada particula
+    :param social: Peso de la atraccion hacia el mejor punto del enjambre
+    :param verbose: Si es True imprime el mejor costo de cada iteracion
+    :param simulation_parameters: Parametros adicionales de evaluate_population
+    :return: tupla (mejores parametros, mejor costo, historia del mejor costo por iteracion)
+    """
+    rng = np.random.default_rng(seed)
+    initial = get_parameter_vector(build_controller(ctrl_name, simulation_parameters.get("sampling_interval", 10)))
+    lower, upper = default_bounds(ctrl_name, initial) if bounds is None else bounds
+    positions = rng.uniform(lower, upper, (n_particles, initial.shape[0]))
+    positions[0] = initial
+    velocities = np.zeros_like(positions)
+
+    best_positions = positions.copy()
+    best_costs = evaluate_population(ctrl_name, positions, **simulation_parameters)
+    history = list()
+    for iteration in range(n_iterations):
+        leader = best_positions[np.argmin(best_costs)]
+        r_1, r_2 = rng.random(positions.shape), rng.random(positions.shape)
+        velocities = inertia * velocities + cognitive * r_1 * (best_positions - positions) + \
+            social * r_2 * (leader - positions)
+        positions = np.clip(positions + velocities, lower, upper)
+        costs = evaluate_population(ctrl_name, positions, prune_costs=best_costs, **simulation_parameters)
+        improved = costs < best_costs
+        best_positions[improved], best_costs[improved] = positions[improved], costs[improved]
+        history.append(float(np.min(best_costs)))
+        if verbose:
+            print(f"Iteration {iteration + 1}/{n_iterations}: best cost {history[-1]:.4f}")
+    best = np.argmin(best_costs)
+    return best_positions[best], float(best_costs[best]), history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajuste de los parametros de los controladores con PSO")
+    parser.add_argument("--controller", default="nn", choices=["nn", "rbf"], help="Controlador")
+    parser.add_argument("--mode", default="ballast", choices=["ballast", "full"], help="Modo del tanker")
+    parser.add_argument("--steps", type=int, default=4000, help="Numero de pasos de simulacion")
+    parser.add_argument("--sampling-interval", type=int, default=10, help="Intervalo de muestreo del controlador")
+    parser.add_argument("--particles", type=int, default=40, help="Numero de particulas")
+    parser.add_argument("--iterations", type=int, default=50, help="Numero de iteraciones")
+    parser.add_argument("--effort-weight", type=float, default=0.01, help="Peso del esfuerzo de control")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del generador aleatorio")
+    parser.add_argument("--output", default="tuned_parameters.json", help="Archivo JSON con los parametros")
+    args = parser.parse_args()
+
+    best_vector, best_cost, _ = tune(args.controller, args.particles, args.iterations, seed=args.seed, verbose=True,
+                                     mode=args.mode, simulation_steps=args.steps,
+                                     sampling_interval=args.sampling_interval, effort_weight=args.effort_weight)
+    tuned_controller = build_controller(args.controller, args.sampling_interval)
+    set_parameter_vector(tuned_controller, best_vector)
+    tuned_parameters = {name: np.asarray(value).tolist() for name, value in tuned_controller.get_parameters().items()}
+    with open(args.output, "w") as output_file:
+        json.dump({"cost": best_cost, "parameters": tuned_parameters}, output_file, indent=2)
+    print(f"Best cost {best_cost:.4f} saved to {args.output}")
@@ -1,20 +1,137 @@
-import matplotlib.pyplot as plt
+import sys
+import numpy as np
 
 
-def plot_hist(psi, refs, rudder_hist):
-    fig, axs = plt.subplots(2, 1)
+def create_figure(figsize=(6.4, 4.8), offscreen=False):
+    """
+    Crea una figura de matplotlib.
+    Las figuras offscreen se crean sin pyplot y se dibujan con el backend no interactivo Agg al guardarlas,
+    por lo que no abren ventanas, no quedan registradas en pyplot y se liberan al dejar de usarlas.
+    :param figsize: Tamaño de la figura [pulgadas]
+    :param offscreen: Si es True la figura solo se puede guardar en un archivo
+    :return: figura
+    """
+    if offscreen:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-    axs[0].plot(psi, color="black", linewidth=1, label="Ship heading")
-    axs[0].plot(refs, color="black", linewidth=1, linestyle="--", label="Desired ship heading")
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        return fig
+    import matplotlib.pyplot as plt
+
+    return plt.figure(figsize=figsize)
+
+
+def show_figure(fig, output=None, dpi=100):
+    """
+    Muestra la figura o la guarda en un archivo.
+    :param fig: Figura creada con create_figure
+    :param output: Ruta opcional del archivo (el formato se deduce de la extension). Si es None se muestra la figura
+    :param dpi: Resolucion del archivo [puntos por pulgada]
+    :return:
+    """
+    if output is None:
+        import matplotlib.pyplot as plt
+
+        plt.show()
+    else:
+        fig.savefig(output, dpi=dpi)
+
+
+def get_grid_resolution(figsize, dpi, pixels_per_line=8):
+    """
+    Numero de puntos por eje de una malla graficada como wireframe, de modo que las lineas queden separadas
+    por unos pocos pixeles en la imagen de salida. Mas puntos no cambian la imagen y solo agregan tiempo.
+    :param figsize: Tamaño de la figura [pulgadas]
+    :param dpi: Resolucion de la figura [puntos por pulgada]
+    :param pixels_per_line: Separacion aproximada entre lineas [pixeles]
+    :return: numero de puntos por eje
+    """
+    return max(2, int(min(figsize) * dpi / pixels_per_line))
+
+
+def decimate_envelope(values, max_points, block_size=1000000):
+    """
+    Reduce una serie a lo sumo a max_points puntos conservando su envolvente: la serie se divide en
+    max_points/2 intervalos y de cada uno se conservan el minimo y el maximo en el orden en que ocurren.
+    Graficada con un intervalo por pixel, la serie reducida se ve igual a la original.
+    La serie se lee por bloques de block_size muestras, por lo que puede ser una columna de un np.memmap.
+    :param values: Serie de forma (n,)
+    :param max_points: Numero maximo de puntos de la serie reducida
+    :param block_size: Numero de muestras leidas a la vez
+    :return: tupla (indexes, values) con los indices de las muestras conservadas y sus valores
+    """
+    n_values = values.shape[0]
+    if n_values <= max_points:
+        return np.arange(n_values), np.asarray(values, dtype=float)
+    bin_size = -(-n_values // (max_points // 2))
+    block_size = bin_size * max(1, block_size // bin_size)
+    indexes, decimated = list(), list()
+    for start in range(0, n_values, block_size):
+        block = np.asarray(values[start:start + block_size], dtype=float)
+        n_bins = -(-block.shape[0] // bin_size)
+        # El ultimo intervalo puede estar incompleto; se rellena repitiendo su ultima muestra
+        padded = np.concatenate((block, np.repeat(block[-1:], n_bins * bin_size - block.shape[0])))
+        bins = padded.reshape(n_bins, bin_size)
+        arg_min, arg_max = np.argmin(bins, axis=1), np.argmax(bins, axis=1)
+        pair = np.sort(np.stack((arg_min, arg_max), axis=1), axis=1)
+        pair = np.minimum(pair + (start + bin_size * np.arange(n_bins))[:, None], start + block.shape[0] - 1)
+        indexes.append(pair.ravel())
+        decimated.append(padded[(pair - start).ravel()])
+    return np.concatenate(indexes), np.concatenate(decimated)
+
+
+def plot_hist(psi, refs, rudder_hist, output=None, dpi=100, figsize=(6.4, 4.8), scale=1.0):
+    """
+    Grafica el angulo del barco, la referencia y la señal de control.
+    Las series se reducen con decimate_envelope a dos puntos por pixel del ancho de la figura, por lo que
+    el tiempo y la memoria usados no dependen del numero de pasos.
+    :param psi: Angulo del barco en cada paso
+    :param refs: Referencia en cada paso
+    :param rudder_hist: Señal de control en cada paso
+    :param output: Ruta opcional de un archivo donde se guarda la figura sin mostrarla (ver show_figure)
+    :param dpi: Resolucion de la figura [puntos por pulgada]
+    :param figsize: Tamaño de la figura [pulgadas]
+    :param scale: Factor por el que se multiplican las series, por ejemplo 180/pi para graficar en grados
+                  series en radianes
+    :return:
+    """
+    max_points = 2 * int(figsize[0] * dpi)
+
+    def envelope(values):
+        indexes, decimated = decimate_envelope(values, max_points)
+        return indexes, decimated * scale
+
+    fig = create_figure(figsize, offscreen=output is not None)
+    axs = fig.subplots(2, 1)
+
+    axs[0].plot(*envelope(psi), color="black", linewidth=1, label="Ship heading")
+    axs[0].plot(*envelope(refs), color="black", linewidth=1, linestyle="--", label="Desired ship heading")
     axs[0].set_title('Ship heading vs Desired ship heading')
     axs[0].legend()
     axs[0].set(ylabel='[deg]')
     axs[0].grid(True)
 
-    axs[1].plot(rudder_hist, color="black", linewidth=1, label="Ship heading")
+    axs[1].plot(*envelope(rudder_hist), color="black", linewidth=1, label="Ship heading")
     axs[1].set_title('Rudder Angle')
     axs[1].set(xlabel='time [s]', ylabel=f'$\delta$ [deg]')
     axs[1].grid(True)
 
     fig.tight_layout()
-    plt.show()
\ No newline at end of file
+    show_figure(fig, output, dpi)
+
+
+def plot_trajectory_file(path, output=None):
+    """
+    Grafica una trayectoria guardada por simulator.py. El archivo contiene un arreglo de forma (steps, 5)
+    con las columnas [x1, x2, x3, referencia, señal de control] en radianes.
+    :param path: Ruta del archivo .npy
+    :param output: Ruta opcional de un archivo donde se guarda la figura sin mostrarla
+    """
+    trajectory = np.load(path, mmap_mode="r")
+    plot_hist(trajectory[:, 0], trajectory[:, 3], trajectory[:, 4], output=output, scale=180/np.pi)
+
+
+if __name__ == "__main__":
+    plot_trajectory_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)